@@ -0,0 +1,154 @@
+import os
+import csv
+import sys
+import json
+import time
+import argparse
+import importlib
+import tracemalloc
+
+# ✅ スコア計算・抽出処理のマイクロベンチマーク
+# 実際のスニペット（bing_cache_playwright.json / output.csv）を材料に、
+# 関数ごとの処理速度（ops/sec）と1回あたりの確保メモリを測る。
+# 同時に extract_info の結果を期待値と照合し、速くなった代わりに
+# 新社名が変わってしまう変更を見逃さないようにする。
+#   python bench_scoring.py                    速度と結果を検査
+#   python bench_scoring.py --update-baseline  この環境の速度を基準として保存
+#   python bench_scoring.py --update-expected  抽出結果の期待値を作り直す
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SOURCES = [os.path.join(HERE, "bing_cache_playwright.json"), os.path.join(HERE, "output.csv")]
+BASELINE_FILE = os.path.join(HERE, "bench_baseline.json")
+EXPECTED_FILE = os.path.join(HERE, "bench_expected.json")
+ENGINES = {"selenium": "check_company_name", "playwright": "company_name_change_checker"}
+
+
+# ✅ 材料: (会社名, タイトル, スニペット, URL)
+def load_corpus(paths):
+    corpus = []
+    for path in paths:
+        if path.endswith(".json"):
+            with open(path, "r", encoding="utf-8") as f:
+                for row in json.load(f).values():
+                    title = row[0] if row[4] != "変更あり" else f"{row[0]} {row[1]}"
+                    corpus.append((row[0], title, row[5] or "", row[6] or ""))
+        else:
+            with open(path, "r", encoding="utf-8-sig", newline="") as f:
+                for row in csv.DictReader(f):
+                    corpus.append((row["会社名"], row["会社名"], row["検出文"] or "", row["URL"] or ""))
+    return corpus
+
+
+def cases(module, corpus):
+    fns = {
+        "extract_info": (module.extract_info, [(title + "\n" + snippet, company) for company, title, snippet, url in corpus]),
+        "result_score": (module.result_score, [(company, title, snippet, url) for company, title, snippet, url in corpus]),
+        "domain_score": (module.domain_score, [(url,) for _, _, _, url in corpus]),
+        "is_low_quality": (module.is_low_quality, [(snippet, url) for _, _, snippet, url in corpus]),
+        "normalize_company": (module.normalize_company, [(company,) for company, _, _, _ in corpus]),
+    }
+    if hasattr(module, "clean_bing_redirect"):
+        fns["clean_bing_redirect"] = (module.clean_bing_redirect, [(url,) for _, _, _, url in corpus])
+    return fns
+
+
+def bench(fn, arg_list, min_time):
+    for args in arg_list:  # ウォームアップ（キャッシュ・遅延初期化を済ませる）
+        fn(*args)
+    ops = 0
+    started = time.perf_counter()
+    while True:
+        for args in arg_list:
+            fn(*args)
+        ops += len(arg_list)
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            break
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    for args in arg_list:
+        fn(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return ops / elapsed, max(0, peak - before) / len(arg_list)
+
+
+def expected_outputs(module, corpus):
+    return [list(module.extract_info(title + "\n" + snippet, company)) for company, title, snippet, _ in corpus]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="スコア計算・抽出処理のマイクロベンチマーク")
+    parser.add_argument("--corpus", nargs="*", default=DEFAULT_SOURCES, help="材料（bing_cache_*.json / 出力CSV）")
+    parser.add_argument("--engine", choices=list(ENGINES), action="append", help="対象（省略時は両方）")
+    parser.add_argument("--min-time", type=float, default=0.5, help="関数ごとの最短計測時間（秒）")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="基準からの低下をどこまで許すか（0.2 = 20%%）")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--update-expected", action="store_true")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        parser.error("材料が空です")
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    expected = {}
+    if os.path.exists(EXPECTED_FILE):
+        with open(EXPECTED_FILE, "r", encoding="utf-8") as f:
+            expected = json.load(f)
+
+    print(f"材料: {len(corpus)}件")
+    failures = []
+    measured = {}
+    for engine in args.engine or list(ENGINES):
+        module = importlib.import_module(ENGINES[engine])
+
+        # 精度: 抽出結果が期待値と一致するか
+        outputs = expected_outputs(module, corpus)
+        if args.update_expected:
+            expected[engine] = {"corpus": [list(c) for c in corpus], "outputs": outputs}
+        elif engine in expected:
+            known = {tuple(c): out for c, out in zip(expected[engine]["corpus"], expected[engine]["outputs"])}
+            for case, out in zip(corpus, outputs):
+                want = known.get(tuple(case))
+                if want is not None and want != out:
+                    failures.append(f"[{engine}] 抽出結果が変わりました: {case[0]}: {want} → {out}")
+
+        # 速度
+        for name, (fn, arg_list) in cases(module, corpus).items():
+            ops, alloc = bench(fn, arg_list, args.min_time)
+            key = f"{engine}.{name}"
+            measured[key] = ops
+            line = f"{key:<40} {ops:>12,.0f} ops/sec {alloc:>9.0f} B/op"
+            base = baseline.get(key)
+            if base:
+                ratio = ops / base
+                line += f"  (基準比 {ratio:.2f})"
+                if ratio < 1 - args.max_regression:
+                    failures.append(f"{key}: {ops:,.0f} ops/sec（基準 {base:,.0f}）")
+            print(line)
+
+    if args.update_baseline:
+        baseline.update(measured)
+        with open(BASELINE_FILE, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2)
+        print(f"基準を保存: {BASELINE_FILE}")
+    if args.update_expected:
+        with open(EXPECTED_FILE, "w", encoding="utf-8") as f:
+            json.dump(expected, f, ensure_ascii=False, indent=1)
+        print(f"期待値を保存: {EXPECTED_FILE}")
+
+    if failures and not (args.update_baseline or args.update_expected):
+        print("\n❌ 失敗:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("✅ OK")
+
+
+if __name__ == "__main__":
+    main()
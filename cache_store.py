@@ -0,0 +1,299 @@
+import os
+import json
+import time
+import queue
+import sqlite3
+import logging
+import argparse
+import threading
+from metrics import METRICS
+
+
+# ✅ 有効期限（日数）: 変更状況ごとに設定する
+DEFAULT_TTL_DAYS = {
+    "変更あり": 180,
+    "変更なし": 90,
+    "処理失敗": 0,  # 失敗は記録のみ（次回は必ず再検索）
+}
+
+def ttl_seconds(ttl_days):
+    return {status: days * 86400 for status, days in ttl_days.items()}
+
+def add_ttl_arguments(parser):
+    parser.add_argument("--ttl-changed", type=float, default=DEFAULT_TTL_DAYS["変更あり"], help="「変更あり」の有効日数")
+    parser.add_argument("--ttl-unchanged", type=float, default=DEFAULT_TTL_DAYS["変更なし"], help="「変更なし」の有効日数")
+    parser.add_argument("--ttl-failed", type=float, default=DEFAULT_TTL_DAYS["処理失敗"], help="「処理失敗」の有効日数")
+    parser.add_argument("--refresh", action="store_true", help="期限切れのキャッシュだけを古い順に再検索する")
+    parser.add_argument("--budget", type=int, default=500, help="--refresh 1回あたりの最大検索数")
+
+def ttl_from_args(args):
+    return {
+        "変更あり": args.ttl_changed,
+        "変更なし": args.ttl_unchanged,
+        "処理失敗": args.ttl_failed,
+    }
+
+
+# ✅ SQLiteキャッシュ（WALモード・1行単位で読み書き）
+# rules は判定ルールの指紋。書き込む行に記録し、ルールが変わった行を見分ける。
+class CacheStore:
+    def __init__(self, path, ttl_days=None, rules=None):
+        self.path = path
+        self.ttl = ttl_seconds(ttl_days or DEFAULT_TTL_DAYS)
+        self.rules = rules
+        self._local = threading.local()
+        self._conns = []
+        self._lock = threading.Lock()
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " key TEXT PRIMARY KEY,"
+                " result TEXT NOT NULL,"
+                " status TEXT,"
+                " fetched_at REAL NOT NULL,"
+                " rules TEXT)"  # NULL = どのルールで判定したか分からない（旧JSONから取り込んだ行）
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_fetched_at ON cache (fetched_at)")
+
+    # スレッドごとに接続を持つ（複数プロセスからの同時利用はWALに任せる）
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    def ttl_for(self, status):
+        # スキップなど旧来の状況は「変更なし」扱い
+        return self.ttl.get(status, self.ttl["変更なし"])
+
+    def is_fresh(self, status, fetched_at, now=None):
+        now = time.time() if now is None else now
+        return fetched_at + self.ttl_for(status) > now
+
+    # 期限切れの行は include_expired=True のときだけ返す
+    def get(self, key, include_expired=False):
+        row = self._conn().execute(
+            "SELECT result, status, fetched_at FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if not include_expired and not self.is_fresh(row[1], row[2]):
+            return None
+        return json.loads(row[0])
+
+    def __contains__(self, key):
+        return self._conn().execute("SELECT 1 FROM cache WHERE key = ?", (key,)).fetchone() is not None
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def put(self, key, result):
+        self.put_many([(key, result)])
+
+    # items は (キー, 結果) か、取得日時を指定するときは (キー, 結果, 取得日時)
+    # stamp=False のときはルールの指紋を記録しない（旧JSONの取り込みなど）
+    def put_many(self, items, replace=True, fetched_at=None, stamp=True):
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        rules = self.rules if stamp else None
+        rows = [
+            (item[0], json.dumps(item[1], ensure_ascii=False), item[1][4],
+             item[2] if len(item) > 2 else fetched_at, rules)
+            for item in items
+        ]
+        if replace:
+            sql = ("INSERT INTO cache (key, result, status, fetched_at, rules) VALUES (?, ?, ?, ?, ?)"
+                   " ON CONFLICT(key) DO UPDATE SET result = excluded.result,"
+                   " status = excluded.status, fetched_at = excluded.fetched_at, rules = excluded.rules")
+        else:
+            sql = "INSERT OR IGNORE INTO cache (key, result, status, fetched_at, rules) VALUES (?, ?, ?, ?, ?)"
+        with self._conn() as conn:
+            conn.executemany(sql, rows)
+
+    # ✅ 期限切れの行を古い順に最大 limit 件返す
+    def expired(self, limit, now=None):
+        now = time.time() if now is None else now
+        rows = self._conn().execute(
+            "SELECT key, result FROM cache"
+            " WHERE fetched_at < ? - CASE status WHEN '変更あり' THEN ? WHEN '処理失敗' THEN ? ELSE ? END"
+            " ORDER BY fetched_at LIMIT ?",
+            (now, self.ttl_for("変更あり"), self.ttl_for("処理失敗"), self.ttl_for("変更なし"), limit),
+        ).fetchall()
+        return [(key, json.loads(result)) for key, result in rows]
+
+    # ✅ 今のルール以外で判定した行（処理失敗は除く）
+    def _stale_where(self):
+        return "(rules IS NULL OR rules != ?) AND status != '処理失敗'", (self.rules or "",)
+
+    def count_stale(self):
+        where, params = self._stale_where()
+        return self._conn().execute(f"SELECT COUNT(*) FROM cache WHERE {where}", params).fetchone()[0]
+
+    # (キー, 結果, 取得日時) を batch_size 件ずつ読み出す
+    def iter_stale(self, batch_size=1000):
+        where, params = self._stale_where()
+        last = ""
+        while True:
+            rows = self._conn().execute(
+                f"SELECT key, result, fetched_at FROM cache WHERE {where} AND key > ? ORDER BY key LIMIT ?",
+                params + (last, batch_size),
+            ).fetchall()
+            if not rows:
+                return
+            for key, result, fetched_at in rows:
+                yield key, json.loads(result), fetched_at
+            last = rows[-1][0]
+
+    # ✅ 別のキャッシュファイル（分担実行のもの等）を取り込む。同じキーは取得日時が新しい方を残す
+    def merge_from(self, path):
+        conn = self._conn()
+        conn.execute("ATTACH DATABASE ? AS src", (path,))
+        try:
+            with conn:
+                return conn.execute(
+                    "INSERT INTO cache (key, result, status, fetched_at, rules)"
+                    " SELECT key, result, status, fetched_at, rules FROM src.cache WHERE true"
+                    " ON CONFLICT(key) DO UPDATE SET result = excluded.result, status = excluded.status,"
+                    " fetched_at = excluded.fetched_at, rules = excluded.rules"
+                    " WHERE excluded.fetched_at > cache.fetched_at"
+                ).rowcount
+        finally:
+            conn.execute("DETACH DATABASE src")
+
+    # 旧JSONキャッシュ（bing_cache_*.json）を取り込む
+    # 取得日時は分からないのでファイルの更新日時を使う
+    # key を渡すと、JSONのキーを key(キー) に置き換えて取り込む
+    def import_json(self, json_path, replace=False, key=None):
+        with open(json_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        items = data.items() if key is None else [(key(k), result) for k, result in data.items()]
+        before = len(self)
+        self.put_many(items, replace=replace, fetched_at=os.path.getmtime(json_path), stamp=False)
+        return len(self) - before if not replace else len(data)
+
+    def close(self):
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            conn.close()
+        self._local = threading.local()
+
+
+# ✅ 書き込み専用スレッド（結果をまとめて一括コミット）
+_STOP = object()
+
+class CacheWriter:
+    def __init__(self, store, batch_size=100, interval=2.0):
+        self.store = store
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue = queue.Queue()
+        # 未コミットの結果（読み出し時に優先して参照する）
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="cache-writer", daemon=True)
+        self._thread.start()
+
+    def get(self, key, include_expired=False):
+        with self._pending_lock:
+            result = self._pending.get(key)
+        if result is not None:
+            # 有効期限0の結果（処理失敗など）は書き込み前でも再検索対象
+            if include_expired or self.store.ttl_for(result[4]) > 0:
+                return result
+            return None
+        return self.store.get(key, include_expired)
+
+    def put(self, key, result):
+        with self._pending_lock:
+            self._pending[key] = result
+        self._queue.put((key, result))
+
+    def _flush(self, batch):
+        if not batch:
+            return True
+        try:
+            with METRICS.span("cache_flush"):
+                self.store.put_many(batch.items())
+        except sqlite3.Error as e:
+            logging.error(f"キャッシュ書き込みエラー（次回再試行）: {e}")
+            return False
+        with self._pending_lock:
+            for key, result in batch.items():
+                if self._pending.get(key) is result:
+                    del self._pending[key]
+        logging.debug(f"キャッシュコミット: {len(batch)}件")
+        batch.clear()
+        return True
+
+    def _run(self):
+        batch = {}
+        deadline = time.monotonic() + self.interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                break
+            if item is not None:
+                key, result = item
+                batch[key] = result
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._flush(batch)
+                deadline = time.monotonic() + self.interval
+        # 終了時は残りをすべて書き出す
+        for _ in range(5):
+            if self._flush(batch):
+                return
+            time.sleep(self.interval)
+        logging.error(f"キャッシュ未保存: {len(batch)}件")
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+
+# ✅ キャッシュを開く（初回のみ旧JSONを自動で取り込む）
+def open_cache(db_path, legacy_json=None, ttl_days=None, rules=None, legacy_key=None):
+    store = CacheStore(db_path, ttl_days, rules)
+    if legacy_json and os.path.exists(legacy_json) and len(store) == 0:
+        count = store.import_json(legacy_json, key=legacy_key)
+        logging.info(f"旧キャッシュ取り込み: {legacy_json} → {db_path} ({count}件)")
+    if rules:
+        stale = store.count_stale()
+        if stale:
+            logging.info(f"古いルールで判定した結果: {stale}件（--reextract で再判定できます）")
+    return store
+
+
+# ✅ 一括インポート
+def main():
+    parser = argparse.ArgumentParser(description="JSONキャッシュをSQLiteへ取り込む")
+    parser.add_argument("db", help="SQLiteキャッシュファイル")
+    parser.add_argument("json_files", nargs="+", help="bing_cache_*.json")
+    parser.add_argument("--replace", action="store_true", help="既存キーをJSONの内容で上書きする")
+    parser.add_argument("--raw-keys", action="store_true",
+                        help="キーを正規化せずに取り込む（既定では両エンジンと同じ正規化名にする）")
+    args = parser.parse_args()
+    # 旧 check_company_name のキー（strip().lower()）も正規化名に揃える（正規化済みのキーは変わらない）
+    from sharding import normalize_company
+    key = None if args.raw_keys else normalize_company
+
+    store = CacheStore(args.db)
+    try:
+        for path in args.json_files:
+            count = store.import_json(path, replace=args.replace, key=key)
+            print(f"{path}: {count}件")
+        print(f"合計: {len(store)}件")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
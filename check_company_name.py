@@ -1,24 +1,46 @@
 import os
 import re
 import time
-import json
-import random
 import logging
 import argparse
-import urllib.parse
-import pandas as pd
+import functools
+import threading
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.options import Options
-from concurrent.futures import ThreadPoolExecutor
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
 from tqdm import tqdm
 import traceback
+from driver_pool import DriverPool
+from memory_usage import rss_bytes, add_recycle_arguments, max_rss_from_args
+from page_stats import LoadStats, TRANSFER_SIZE_JS, BLOCKED_URL_PATTERNS
+from rate_limiter import AdaptiveRateLimiter, add_rate_arguments
+from search_errors import BlockPageError, SerpParseError, SerpTimeoutError, is_block_page, is_no_results_page, READY_SELECTOR, DEFAULT_READY_TIMEOUT
+from search_backends import (SearchBackend, SearchResults, HttpBackend, HedgedBackend, build_query, build_search_url, add_backend_arguments,
+                             DEFAULT_BING_URL, DEFAULT_HEDGE_DELAY, DEFAULT_QUERY_BUDGET)
+from url_rules import DomainIndex, KeywordMatcher, split_url
+from csv_stream import partial_path, IncrementalWriter, finalize_output
+from run_manifest import add_resume_arguments, open_run
+from work_queue import add_queue_arguments, open_queue
+from sharding import add_shard_arguments, shard_path, format_shard
+from cache_store import open_cache, add_ttl_arguments, ttl_from_args, CacheWriter
+from metrics import METRICS, MetricsReporter, add_metrics_arguments, metrics_prefix
+from pipeline import Stage, raise_stage_errors, add_pipeline_arguments, open_cpu_pool
+from resilience import CircuitBreaker, ResilientBackend, RETRY_POLICIES, add_retry_arguments, retry_policies
+from snapshot_store import SnapshotStore, add_snapshot_arguments, reprocess, reextract, describe_change, rule_fingerprint
 
 # ✅ キャッシュファイル
-CACHE_FILE = "bing_cache_v6_final_full.json"
+CACHE_FILE = "bing_cache_v6_final_full.json"  # 旧形式（初回のみ取り込み）
+CACHE_DB = "bing_cache_v6_final_full.sqlite3"
+SNAPSHOT_DB = "bing_snapshots_v6_final_full.sqlite3"  # 検索結果の生データ（再判定用）
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# 軽量モード: 画像・フォント・CSS・計測タグを読み込まない
+LEAN_MODE = True
+
 def get_driver():
     options = Options()
     options.add_argument("--headless=new")
@@ -26,9 +48,33 @@ def get_driver():
     options.add_argument("--window-size=1200,800")
     options.add_argument("--no-sandbox")
     options.add_argument("--disable-dev-shm-usage")
+    # DOM構築までで get() を返し、あとは READY_SELECTOR の出現を待つ
+    options.page_load_strategy = "eager"
+    if LEAN_MODE:
+        options.add_argument("--blink-settings=imagesEnabled=false")
+        options.add_experimental_option("prefs", {
+            "profile.managed_default_content_settings.images": 2,
+            "profile.managed_default_content_settings.plugins": 2,
+            "profile.managed_default_content_settings.popups": 2,
+            "profile.managed_default_content_settings.notifications": 2,
+        })
     driver = webdriver.Chrome(options=options)
+    if LEAN_MODE:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS})
     return driver
 
+def start_driver():
+    with METRICS.span("driver_start"):
+        return get_driver()
+
+# ドライバー（chromedriver とその子の Chrome）のメモリ
+def driver_rss(driver):
+    try:
+        return rss_bytes(pid=driver.service.process.pid)
+    except Exception:
+        return 0
+
 # ✅ ドメインスコア設定
 DOMAIN_PRIORITY = [
     ".co.jp", ".go.jp", ".or.jp",
@@ -47,32 +93,40 @@ LOW_QUALITY_DOMAINS = [
     "zeiri4.com", "bizocean.jp", "corporate.ai-con.lawyer", "kaonavi.jp"
 ]
 
+LOW_KEYWORDS = [
+    "商号変更とは", "社名変更とは", "会社名が変更になる場合は"
+]
+
+# ✅ ホスト名で引く索引（一覧が増えても1件あたりの判定はURL長に比例）
+LOW_QUALITY_INDEX = DomainIndex(LOW_QUALITY_DOMAINS)
+DOMAIN_PRIORITY_INDEX = DomainIndex(DOMAIN_PRIORITY)
+LOW_KEYWORD_MATCHER = KeywordMatcher(LOW_KEYWORDS)
+
 def domain_score(url):
     url = url or ""
-    for domain in LOW_QUALITY_DOMAINS:
-        if domain in url:
-            return -100
-    for i, domain in enumerate(DOMAIN_PRIORITY):
-        if domain in url:
-            return len(DOMAIN_PRIORITY) - i
+    if url in LOW_QUALITY_INDEX:
+        return -100
+    rank = DOMAIN_PRIORITY_INDEX.match(url)
+    if rank is not None:
+        return len(DOMAIN_PRIORITY) - rank
     return 0
 
 # ✅ フィルター
 def is_low_quality(snippet, url):
-    low_keywords = [
-        "商号変更とは", "社名変更とは", "会社名が変更になる場合は"
-    ]
-    snippet = snippet or ""
-    url = url or ""
-    for kw in low_keywords:
-        if kw in snippet or kw in url:
-            return True
-    return False
+    return LOW_KEYWORD_MATCHER.search(snippet or "") or LOW_KEYWORD_MATCHER.search(url or "")
 
-# ✅ キーワード部分一致
-def company_in_text(company, text):
+# ✅ 重複判定用の正規化名（「株式会社マーブル」と「マーブル株式会社」は同じ）
+def normalize_company(name):
+    return name.replace("株式会社", "").replace(" ", "").replace("　", "").lower()
+
+# ✅ キーワード部分一致（会社ごとのパターンは1回だけコンパイル）
+@functools.lru_cache(maxsize=4096)
+def company_keyword_re(company):
     keyword = company.replace("株式会社", "").strip()
-    return re.search(re.escape(keyword), text, re.IGNORECASE) is not None
+    return re.compile(re.escape(keyword), re.IGNORECASE)
+
+def company_in_text(company, text):
+    return company_keyword_re(company).search(text) is not None
 
 # ✅ スコア計算
 def result_score(company, title, snippet, url):
@@ -82,23 +136,105 @@ def result_score(company, title, snippet, url):
     return score
 
 # ✅ Bing検索
-def search_bing(driver, company):
-    query = f"{company} 社名変更 OR 商号変更 OR 新社名"
-    url = f"https://www.bing.com/search?q={urllib.parse.quote(query)}"
-    driver.get(url)
-    time.sleep(random.uniform(1.5, 4.5))
-    results = []
-    for elem in driver.find_elements(By.CSS_SELECTOR, "li.b_algo")[:10]:
-        try:
-            title = elem.find_element(By.TAG_NAME, "h2").text
-            snippet = elem.find_element(By.CLASS_NAME, "b_caption").text
-            link = elem.find_element(By.TAG_NAME, "a").get_attribute("href")
-            results.append((title + "\n" + snippet, snippet, link))
-        except Exception as e:
-            logging.debug(f"検索結果解析エラー: {e}")
-            continue
+# 全ワーカー共通の速度制御（ワーカーごとのランダムsleepの代わり）
+RATE_LIMITER = AdaptiveRateLimiter()
+# 検索結果の表示待ちの上限（秒）。固定の待ち時間は置かない
+READY_TIMEOUT = DEFAULT_READY_TIMEOUT
+BING_URL = DEFAULT_BING_URL
+# 言い換えクエリ（off / delay / parallel）
+HEDGE_MODE = "off"
+HEDGE_DELAY = DEFAULT_HEDGE_DELAY
+QUERY_BUDGET = DEFAULT_QUERY_BUDGET
+# 失敗の分類ごとの再試行と、失敗が続いたら全ワーカーの検索を止めるブレーカー
+RETRY = RETRY_POLICIES
+BREAKER = CircuitBreaker()
+
+def wait_until_ready(driver, timeout):
+    try:
+        WebDriverWait(driver, timeout).until(
+            EC.presence_of_element_located((By.CSS_SELECTOR, READY_SELECTOR))
+        )
+    except TimeoutException:
+        logging.debug(f"表示待ちタイムアウト: {timeout}秒")
+
+LOAD_STATS = LoadStats()
+
+def record_page_load(driver, seconds):
+    try:
+        transfer_bytes = driver.execute_script(TRANSFER_SIZE_JS)
+    except Exception:
+        transfer_bytes = 0
+    LOAD_STATS.record(transfer_bytes, seconds)
+
+def search_bing(driver, company, query=None):
+    query = query or build_query(company)
+    url = build_search_url(query, BING_URL)
+    with METRICS.span("rate_wait"):
+        RATE_LIMITER.acquire()
+    started = time.perf_counter()
+    with METRICS.span("navigate"):
+        driver.get(url)
+    with METRICS.span("ready_wait"):
+        wait_until_ready(driver, READY_TIMEOUT)
+    record_page_load(driver, time.perf_counter() - started)
+    with METRICS.span("scrape"):
+        elements = driver.find_elements(By.CSS_SELECTOR, "li.b_algo")
+        if not elements:
+            html = driver.page_source
+            if is_block_page(html):
+                METRICS.count("block_page")
+                RATE_LIMITER.on_block("ブロックページ")
+                raise BlockPageError(f"ブロックページを検出: {company}")
+            if not is_no_results_page(html):
+                # 表示待ちがタイムアウトした。「変更なし」として記録せず、再試行に回す
+                METRICS.count("empty_results")
+                RATE_LIMITER.on_block("検索結果が空")
+                raise SerpTimeoutError(f"検索結果が表示されません（{READY_TIMEOUT:g}秒）: {company}")
+        RATE_LIMITER.on_success()
+        results = SearchResults(query=query)
+        for elem in elements[:10]:
+            try:
+                title = elem.find_element(By.TAG_NAME, "h2").text
+                snippet = elem.find_element(By.CLASS_NAME, "b_caption").text
+                link = elem.find_element(By.TAG_NAME, "a").get_attribute("href")
+                results.append((title + "\n" + snippet, snippet, link))
+            except Exception as e:
+                logging.debug(f"検索結果解析エラー: {e}")
+                continue
+        if elements and not results:
+            raise SerpParseError(f"検索結果を読み取れません: {company}")
     return results
 
+# ✅ Seleniumバックエンド（ドライバープールから借りて検索する）
+# ドライバーは RECYCLE_PAGES 回使うか、メモリが MAX_RSS を超えたら作り直す
+RECYCLE_PAGES = 500
+MAX_RSS = 0
+
+class SeleniumBackend(SearchBackend):
+    name = "selenium"
+
+    def __init__(self, size):
+        self.size = size
+        self.pool = DriverPool(start_driver, size, RECYCLE_PAGES, MAX_RSS, driver_rss)
+
+    def search(self, company, query=None):
+        with self.pool.lease() as driver:
+            return search_bing(driver, company, query)
+
+    def close(self):
+        self.pool.close()
+
+def open_backend(name, size):
+    if name == "http":
+        backend = HttpBackend(size, RATE_LIMITER, BING_URL, stats=LOAD_STATS)
+    else:
+        backend = SeleniumBackend(size)
+    backend = ResilientBackend(backend, BREAKER, RETRY)
+    if HEDGE_MODE != "off":
+        # 再試行はヘッジの内側（言い換えごとに再試行し、合計は --query-budget 回まで）
+        backend = HedgedBackend(backend, is_confident, HEDGE_MODE, HEDGE_DELAY, QUERY_BUDGET)
+    return backend
+
 # 🚫 除外ワード
 EXCLUDE_NAME_PATTERNS = [
     r"正式には", r"通称", r"呼ばれ", r"一般的に", r"略称", r"通名", r"会社名とは", r"社名とは"
@@ -109,26 +245,36 @@ BAD_NAMES = [
     "当ページを参考", "こちら", "不明", "参考", "社名は", "といいます", "正式には", "商号", "社名変更とは"
 ]
 
+# ✅ 抽出パターン（モジュール読み込み時に1回だけコンパイル）
+NAME_PATTERN = (
+    r'社名(?:を)?「?([^\s「」]{2,})」?に変更|'
+    r'新社名は「?([^\s「」]{2,})」?|'
+    r'「?([^\s「」]{2,})株式会社」?に変更|'
+    r'([^\s「」]{2,})株式会社に変更'
+)
+# どのパターンも「に変更」か「新社名」を含まないと一致しない
+NAME_TRIGGERS = ("に変更", "新社名")
+
+EXCLUDE_NAME_RE = re.compile("|".join(EXCLUDE_NAME_PATTERNS))
+NAME_RE = re.compile(NAME_PATTERN)
+DATE_RE = re.compile(r"(\d{4}年\d{1,2}月\d{1,2}日|\d{4}年\d{1,2}月|\d{4}年)")
+REASON_RE = re.compile(r"(理由は[^。]{3,15})。")
+BAD_NAME_SET = frozenset(BAD_NAMES)
+
 # ✅ extract_info 改良版
 def extract_info(text, old_name):
-    if any(re.search(pat, text) for pat in EXCLUDE_NAME_PATTERNS):
+    # キーワードが無い文は正規表現を走らせずに除外
+    if not any(trigger in text for trigger in NAME_TRIGGERS):
+        return None, None, None
+    if EXCLUDE_NAME_RE.search(text):
         return None, None, None
 
-    name_match = re.search(
-        r'社名(?:を)?「?([^\s「」]{2,})」?に変更|'
-        r'新社名は「?([^\s「」]{2,})」?|'
-        r'「?([^\s「」]{2,})株式会社」?に変更|'
-        r'([^\s「」]{2,})株式会社に変更', 
-        text
-    )
-
-    date_match = re.search(r"(\d{4}年\d{1,2}月\d{1,2}日|\d{4}年\d{1,2}月|\d{4}年)", text)
-    reason_match = re.search(r"(理由は[^。]{3,15})。", text)
+    name_match = NAME_RE.search(text)
 
     new_name = None
     if name_match:
         for g in name_match.groups():
-            if g and g not in BAD_NAMES and not g.startswith("は"):
+            if g and g not in BAD_NAME_SET and not g.startswith("は"):
                 new_name = g
                 break
     if not new_name:
@@ -137,114 +283,344 @@ def extract_info(text, old_name):
     if old_name.replace("株式会社", "").strip() in new_name:
         return None, None, None
 
+    date_match = DATE_RE.search(text)
+    reason_match = REASON_RE.search(text)
     date = date_match.group(1) if date_match else "変更日不明"
     reason = reason_match.group(1).replace("理由は", "") if reason_match else "不明"
 
     return new_name, date, reason
 
-# ✅ キャッシュ操作
-def load_cache():
-    if os.path.exists(CACHE_FILE):
-        with open(CACHE_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
-
-def save_cache(cache):
-    with open(CACHE_FILE, "w", encoding="utf-8") as f:
-        json.dump(cache, f, ensure_ascii=False, indent=2)
-
-# ✅ 会社1社ずつ処理
-def analyze_company(company):
-    cache = load_cache()
-    key = company.strip().lower()
-
-    if key in cache:
-        logging.info(f"【RESUME】スキップ: {company}")
-        result = cache[key]
-        if result[4] == "スキップ":
-            result[4] = "変更なし"
-        return result
-
-    driver = None
-    try:
-        logging.info(f"検索開始: {company}")
-        driver = get_driver()
-        results = search_bing(driver, company)
-
-        results_sorted = sorted(
-            [r for r in results if not is_low_quality(r[1], r[2])],
-            key=lambda x: result_score(company, x[0], x[1], x[2]),
-            reverse=True
-        )
+# ✅ 検索結果から判定する（副作用なし。プロセスプールでも動く）
+def decide(company, results):
+    results_sorted = sorted(
+        [r for r in results if not is_low_quality(r[1], r[2])],
+        key=lambda x: result_score(company, x[0], x[1], x[2]),
+        reverse=True
+    )
 
-        for full_text, snippet, url in results_sorted:
-            new_name, date, reason = extract_info(full_text, company)
-            if new_name:
-                result = [company, new_name, date, reason, "変更あり", snippet or "なし", url or ""]
-                cache[key] = result
-                save_cache(cache)
-                return result
-
-        if results_sorted:
-            snippet = results_sorted[0][1] or "なし"
-            url = results_sorted[0][2] or ""
-        else:
-            snippet = "なし"
-            url = ""
-
-        result = [company, "変更なし", "変更日不明", "不明", "変更なし", snippet, url]
-        cache[key] = result
-        save_cache(cache)
-        return result
-
-    except Exception as e:
-        logging.error(f"エラー: {company} - {e}")
-        logging.error(traceback.format_exc())
-        return [company, "エラー", "不明", "不明", "処理失敗", str(e), ""]
-    finally:
-        if driver:
-            driver.quit()
+    for full_text, snippet, url in results_sorted:
+        new_name, date, reason = extract_info(full_text, company)
+        if new_name:
+            return [company, new_name, date, reason, "変更あり", snippet or "なし", url or ""]
+
+    if results_sorted:
+        snippet = results_sorted[0][1] or "なし"
+        url = results_sorted[0][2] or ""
+    else:
+        snippet = "なし"
+        url = ""
+
+    return [company, "変更なし", "変更日不明", "不明", "変更なし", snippet, url]
+
+# ✅ 判定ルールの指紋（キャッシュの各行に記録し、--reextract で古い行だけ判定し直す）
+RULES_VERSION = rule_fingerprint(
+    [DOMAIN_PRIORITY, LOW_QUALITY_DOMAINS, LOW_KEYWORDS, EXCLUDE_NAME_PATTERNS, BAD_NAMES,
+     NAME_PATTERN, list(NAME_TRIGGERS), DATE_RE.pattern, REASON_RE.pattern],
+    [normalize_company, split_url, DomainIndex, KeywordMatcher, domain_score, is_low_quality, company_keyword_re,
+     company_in_text, result_score, extract_info, decide],
+)
+
+# 言い換えを打ち切ってよい結果（社名変更が見つかった）
+def is_confident(company, results):
+    return decide(company, results)[4] == "変更あり"
+
+def failed_result(company, e):
+    METRICS.count("error")
+    logging.error(f"エラー: {company} - {e}")
+    logging.error(traceback.format_exc())
+    return [company, "エラー", "不明", "不明", "処理失敗", str(e), ""]
+
+# キャッシュは正規化名で引く（表記違いの会社名も同じ結果を使い、出力は行ごとの会社名にする）
+def cached_result(company, cache):
+    result = cache.get(normalize_company(company))
+    if result is None:
+        METRICS.count("cache_miss")
+        return None
+    METRICS.count("cache_hit")
+    logging.info(f"【RESUME】スキップ: {company}")
+    status = "変更なし" if result[4] == "スキップ" else result[4]
+    return [company] + result[1:4] + [status] + result[5:]
 
 # ✅ 並列処理
-def process_all(companies):
-    max_workers = 6
-    logging.info(f"スレッド数: {max_workers}")
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        results = list(tqdm(executor.map(lambda c: analyze_company(c), companies), total=len(companies)))
-    return results
+MAX_WORKERS = 6  # ノートPC向け
+
+# rows は (行番号, 会社名) を順に返すイテラブル。
+# 検索（ブラウザ待ち）→ 判定（CPU）→ 書き込み（ディスク）を別々の段で処理し、
+# 段の間の待ち行列に上限を設けるので、入力がいくら大きくてもメモリは一定。
+# 判定や書き込みが重くても検索枠は空かない。cpu_pool を渡すと判定は別プロセスで行う。
+# snapshots を渡すと検索結果の生データも保存する。
+# 正規化名が同じ行は1回だけ検索し、結果を重複行にも配る。
+def process_all(rows, backend, cache, on_result, cpu_workers=1, cpu_pool=None, snapshots=None):
+    fetch_workers = backend.size
+    logging.info(f"スレッド数: 検索 {fetch_workers} / 判定 {cpu_workers}")
+    waiting = {}  # 正規化名 -> 結果待ちの重複行
+    waiting_lock = threading.Lock()
+    duplicates = 0
+
+    with tqdm() as progress:
+        # results は検索した場合のみ（キャッシュヒット・検索失敗は None）
+        def write(item):
+            row_no, company, key, result, store, results = item
+            if store:
+                with METRICS.span("cache_write"):
+                    cache.put(key, result)
+            if snapshots is not None and results is not None:
+                with METRICS.span("snapshot_write"):
+                    snapshots.put(key, company, getattr(results, "query", None), results)
+            on_result(row_no, result)
+            progress.update()
+            with waiting_lock:
+                dups = waiting.pop(key, [])
+            for dup_row_no, dup_company in dups:
+                on_result(dup_row_no, [dup_company] + result[1:])
+                progress.update()
+
+        def judge(item):
+            row_no, company, key, results = item
+            try:
+                with METRICS.span("extract"):
+                    if cpu_pool is not None:
+                        result = cpu_pool.submit(decide, company, results).result()
+                    else:
+                        result = decide(company, results)
+                METRICS.count("changed" if result[4] == "変更あり" else "unchanged")
+            except Exception as e:
+                result = failed_result(company, e)
+            sink.put((row_no, company, key, result, True, results))
+
+        def fetch(item):
+            row_no, company, key = item
+            result = cached_result(company, cache)
+            if result is not None:
+                sink.put((row_no, company, key, result, False, None))
+                return
+            try:
+                logging.info(f"検索開始: {company}")
+                with METRICS.span("search"):
+                    results = backend.search(company)
+            except Exception as e:
+                sink.put((row_no, company, key, failed_result(company, e), True, None))
+                return
+            cpu.put((row_no, company, key, results))
+
+        sink = Stage("sink", write, 1, fetch_workers * 4)
+        cpu = Stage("cpu", judge, cpu_workers, fetch_workers * 2)
+        searcher = Stage("fetch", fetch, fetch_workers, fetch_workers * 2)
+        stages = [searcher, cpu, sink]
+        try:
+            for row_no, company in rows:
+                key = normalize_company(company)
+                with waiting_lock:
+                    if key in waiting:
+                        waiting[key].append((row_no, company))
+                        duplicates += 1
+                        continue
+                    waiting[key] = []
+                searcher.put((row_no, company, key))
+        finally:
+            # 前の段から順に、投入済みの分を処理し終えて止める
+            for stage in stages:
+                stage.close()
+        raise_stage_errors(stages)
+    if duplicates:
+        logging.info(f"重複行をまとめて処理: {duplicates}行")
+
+# ✅ 期限切れキャッシュの再検索
+def refresh_expired(store, cache, budget, backend_name, workers, cpu_workers=1, cpu_pool=None, snapshots=None):
+    expired = store.expired(budget)
+    logging.info(f"期限切れ再検索: {len(expired)}社（上限 {budget}社）")
+    if not expired:
+        return
+    results = {}
+    with open_backend(backend_name, workers) as backend:
+        process_all(((i, row[0]) for i, (_, row) in enumerate(expired)), backend, cache, results.__setitem__,
+                    cpu_workers, cpu_pool, snapshots)
+    changed = sum(1 for i, (_, old) in enumerate(expired) if old[1:5] != results[i][1:5])
+    logging.info(f"再検索完了: {len(results)}社（結果が変わった会社 {changed}社）")
+    logging.info(LOAD_STATS.summary())
 
 # ✅ メイン
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("input", help="会社名CSVファイル")
-    parser.add_argument("output", help="出力CSVファイル")
+    parser.add_argument("input", nargs="?", help="会社名CSVファイル")
+    parser.add_argument("output", nargs="?", help="出力CSVファイル")
+    parser.add_argument("--chunksize", type=int, default=1000, help="入力CSVを読む単位（行）")
+    parser.add_argument("--order", choices=["input", "completion"], default="input",
+                        help="最終出力の並び順（input: 入力順に並べ替え / completion: 完了順）")
+    add_ttl_arguments(parser)
+    add_resume_arguments(parser)
+    add_rate_arguments(parser)
+    add_backend_arguments(parser)
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="同時に検索するスレッド数")
+    parser.add_argument("--no-lean", action="store_true", help="画像・CSSなども読み込む（転送量の比較用）")
+    parser.add_argument("--ready-timeout", type=float, default=DEFAULT_READY_TIMEOUT, help="検索結果の表示を待つ上限（秒）")
+    add_metrics_arguments(parser)
+    add_pipeline_arguments(parser)
+    add_snapshot_arguments(parser)
+    add_shard_arguments(parser)
+    add_queue_arguments(parser)
+    add_retry_arguments(parser)
+    add_recycle_arguments(parser)
     args = parser.parse_args()
-
-    df = pd.read_csv(args.input)
-    companies = df["会社名"].dropna().tolist()
-    logging.info(f"対象社数: {len(companies)}社")
-
-    results_dict = {}
-    all_results = []
-
-    for result in process_all(companies):
-        key = result[0].strip().lower()
-        results_dict[key] = result
-        all_results.append(result)
-
-    df_out_rows = []
-    for company in companies:
-        key = company.strip().lower()
-        result = results_dict.get(key)
-        if result is None:
-            result = analyze_company(company)
-        df_out_rows.append(result)
-
-    df_out = pd.DataFrame(df_out_rows, columns=[
-        "会社名", "新社名", "変更日", "変更理由", "変更状況", "検出文", "URL"
-    ])
-    df_out.to_csv(args.output, index=False, encoding="utf-8-sig")
-    logging.info(f"出力完了: {args.output}")
+    RATE_LIMITER.configure(rate=args.rate, max_rate=args.max_rate)
+    global READY_TIMEOUT, LEAN_MODE, BING_URL, HEDGE_MODE, HEDGE_DELAY, QUERY_BUDGET, RETRY, RECYCLE_PAGES, MAX_RSS
+    READY_TIMEOUT = args.ready_timeout
+    BING_URL = args.bing_url
+    HEDGE_MODE, HEDGE_DELAY, QUERY_BUDGET = args.hedge, args.hedge_delay, args.query_budget
+    RETRY = retry_policies(args)
+    RECYCLE_PAGES, MAX_RSS = args.recycle_pages, max_rss_from_args(args)
+    BREAKER.configure(window=args.breaker_window, threshold=args.breaker_threshold, cooldown=args.breaker_cooldown)
+    LEAN_MODE = LOAD_STATS.lean = not args.no_lean
+    if not (args.refresh or args.resume or args.reprocess or args.reextract or args.attach) and not (args.input and args.output):
+        parser.error("input と output を指定してください（--refresh / --resume / --reprocess / --reextract / --attach のときは不要）")
+    if args.dry_run and not args.reextract:
+        parser.error("--dry-run は --reextract と一緒に指定してください")
+    if args.queue and args.attach:
+        parser.error("--queue と --attach は同時に指定できません")
+
+    if args.reprocess and args.no_snapshots:
+        parser.error("--reprocess と --no-snapshots は同時に指定できません")
+
+    # 分担実行ではキャッシュ・スナップショットも分担ごとのファイル
+    if args.shard is not None:
+        logging.info(f"分担: {format_shard(args.shard)}")
+    # 旧JSONのキーは正規化前の会社名（strip().lower()）なので、取り込むときに正規化名へ置き換える
+    store = open_cache(shard_path(CACHE_DB, args.shard), CACHE_FILE, ttl_from_args(args), RULES_VERSION,
+                       legacy_key=normalize_company)
+    snapshots = None if args.no_snapshots else SnapshotStore(shard_path(SNAPSHOT_DB, args.shard))
+
+    if args.reextract:
+        cpu_pool = open_cpu_pool(args)
+        try:
+            with tqdm(total=store.count_stale()) as progress:
+                on_change = (lambda *change: progress.write(describe_change(*change))) if args.dry_run else None
+                total, changed, from_snapshots = reextract(store, snapshots, decide, cpu_pool, progress=progress,
+                                                           dry_run=args.dry_run, on_change=on_change)
+        finally:
+            if cpu_pool is not None:
+                cpu_pool.shutdown()
+            if snapshots is not None:
+                snapshots.close()
+            store.close()
+        logging.info(f"再判定{'（書き込みなし）' if args.dry_run else '完了'}（ルール {RULES_VERSION}）: {total}社"
+                     f"（結果が変わる会社 {changed}社、検索結果の生データから {from_snapshots}社）")
+        return
+
+    if args.reprocess:
+        cpu_pool = open_cpu_pool(args)
+        try:
+            with tqdm(total=len(snapshots)) as progress:
+                total, changed = reprocess(snapshots, store, decide, cpu_pool, progress=progress)
+        finally:
+            if cpu_pool is not None:
+                cpu_pool.shutdown()
+            snapshots.close()
+            store.close()
+        logging.info(f"再判定完了: {total}社（結果が変わった会社 {changed}社）")
+        return
+    # 書き込みは専用スレッドに集約する
+    cache = CacheWriter(store)
+    cpu_pool = open_cpu_pool(args)
+
+    if args.refresh:
+        reporter = MetricsReporter(METRICS, metrics_prefix(args), args.metrics_interval).start()
+        try:
+            refresh_expired(store, cache, args.budget, args.backend, args.workers, args.cpu_workers, cpu_pool, snapshots)
+        finally:
+            if snapshots is not None:
+                snapshots.close()
+            if cpu_pool is not None:
+                cpu_pool.shutdown()
+            cache.close()
+            store.close()
+            reporter.close()
+        logging.info(METRICS.report())
+        return
+
+    lessee = None
+    try:
+        if args.queue or args.attach:
+            manifest, lessee = open_queue(args, args.chunksize)
+            rows = lessee.rows()
+        else:
+            manifest, rows = open_run(args, args.chunksize)
+    except ValueError as e:
+        parser.error(str(e))
+    manifest_shard = manifest.shard
+    prefix = metrics_prefix(args, manifest)
+    if args.attach:
+        if not args.metrics:
+            prefix += f".{lessee.worker}"
+        logging.info(f"ワーカーとして参加: {manifest.run_id}（{lessee.worker}）")
+        logging.info(f"メトリクス: {prefix}.json / {prefix}.prom")
+        reporter = MetricsReporter(METRICS, prefix, args.metrics_interval).start()
+        lessee.start()
+        try:
+            with open_backend(args.backend, args.workers) as backend:
+                process_all(rows, backend, cache, manifest.finish, args.cpu_workers, cpu_pool, snapshots)
+        finally:
+            lessee.close()
+            if snapshots is not None:
+                snapshots.close()
+            if cpu_pool is not None:
+                cpu_pool.shutdown()
+            cache.close()
+            store.close()
+            counts = manifest.counts()
+            manifest.close()
+            reporter.close()
+        logging.info(f"ワーカー終了: {lessee.leased}行を処理（行の状態: {counts}）")
+        logging.info(METRICS.report())
+        return
+
+    logging.info(f"実行ID: {manifest.run_id}（再開: --resume {manifest.run_id}）")
+    if lessee is not None:
+        logging.info(f"作業キュー: 他のプロセスは --attach {manifest.run_id} で加われます")
+    output = manifest.output_path
+
+    # 完了した行から順に途中ファイルへ追記する
+    partial = partial_path(output)
+    logging.info(f"途中経過: {partial}")
+    logging.info(f"メトリクス: {prefix}.json / {prefix}.prom")
+    reporter = MetricsReporter(METRICS, prefix, args.metrics_interval).start()
+    if lessee is not None:
+        lessee.start()
+    try:
+        with IncrementalWriter(partial) as writer, open_backend(args.backend, args.workers) as backend:
+            if writer.is_new:
+                # 途中ファイルが無くなっていたら完了済みの行をマニフェストから戻す
+                for row_no, result in manifest.done_results():
+                    writer.write(row_no, result)
+
+            def on_result(row_no, result):
+                writer.write(row_no, result)
+                manifest.finish(row_no, result)
+
+            process_all(rows, backend, cache, on_result, args.cpu_workers, cpu_pool, snapshots)
+            if lessee is not None:
+                # 他のワーカーが処理した行も途中ファイルに入れる
+                for row_no, result in manifest.results_from_others(lessee.worker):
+                    writer.write(row_no, result)
+    finally:
+        if lessee is not None:
+            lessee.close()
+        if snapshots is not None:
+            snapshots.close()
+        if cpu_pool is not None:
+            cpu_pool.shutdown()
+        cache.close()
+        store.close()
+        counts = manifest.counts()
+        manifest.close()
+        # キャッシュの最終書き込みまで含めて書き出す
+        reporter.close()
+    logging.info(f"行の状態: {counts}")
+    logging.info(LOAD_STATS.summary())
+    logging.info(METRICS.report())
+
+    count = finalize_output(partial, output, args.order, row_numbers=manifest_shard is not None)
+    os.remove(partial)
+    logging.info(f"出力完了: {output}（{count}社）")
 
 if __name__ == "__main__":
     main()
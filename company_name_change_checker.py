@@ -1,15 +1,31 @@
 import asyncio
-from playwright.async_api import async_playwright
-import json
+from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
 import re
-import pandas as pd
-import urllib.parse
 import os
-import random
+import time
+import argparse
 from tqdm import tqdm
+from memory_usage import rss_bytes, add_recycle_arguments, max_rss_from_args
+from page_stats import LoadStats, TRANSFER_SIZE_JS, BLOCKED_RESOURCE_TYPES, TRACKER_HOSTS
+from rate_limiter import AdaptiveRateLimiter, add_rate_arguments
+from search_errors import BlockPageError, SerpParseError, SerpTimeoutError, is_block_page, is_no_results_page, READY_SELECTOR, DEFAULT_READY_TIMEOUT
+from search_backends import (AsyncSearchBackend, SearchResults, ThreadedAsyncBackend, AsyncHedgedBackend, HttpBackend, build_query, build_search_url,
+                             add_backend_arguments, DEFAULT_BING_URL, DEFAULT_HEDGE_DELAY, DEFAULT_QUERY_BUDGET)
+from url_rules import DomainIndex, KeywordMatcher, split_url
+from csv_stream import partial_path, IncrementalWriter, finalize_output
+from run_manifest import add_resume_arguments, open_run
+from work_queue import add_queue_arguments, open_queue
+from sharding import add_shard_arguments, shard_path, format_shard
+from cache_store import open_cache, add_ttl_arguments, ttl_from_args
+from metrics import METRICS, MetricsReporter, add_metrics_arguments, metrics_prefix
+from pipeline import AsyncStage, raise_stage_errors, add_pipeline_arguments, open_cpu_pool
+from resilience import CircuitBreaker, AsyncResilientBackend, RETRY_POLICIES, add_retry_arguments, retry_policies
+from snapshot_store import SnapshotStore, add_snapshot_arguments, reprocess, reextract, describe_change, rule_fingerprint
 
 # ✅ キャッシュファイル
-CACHE_FILE = "bing_cache_playwright.json"
+CACHE_FILE = "bing_cache_playwright.json"  # 旧形式（初回のみ取り込み）
+CACHE_DB = "bing_cache_playwright.sqlite3"
+SNAPSHOT_DB = "bing_snapshots_playwright.sqlite3"  # 検索結果の生データ（再判定用）
 
 # ✅ ドメインスコア設定
 DOMAIN_PRIORITY = [
@@ -38,36 +54,37 @@ BAD_NAMES = [
     "当ページを参考", "こちら", "不明", "参考", "社名は", "といいます", "正式には", "商号", "社名変更とは"
 ]
 
+LOW_KEYWORDS = [
+    "商号変更とは", "社名変更とは", "会社名が変更になる場合は",
+    "法人登記", "やり方", "手続き", "無料相談", "注意点", "解説",
+    "法律事務所", "弁護士", "登記変更", "申請方法", "料金"
+]
+
+# ✅ ホスト名で引く索引（一覧が増えても1件あたりの判定はURL長に比例）
+LOW_QUALITY_INDEX = DomainIndex(LOW_QUALITY_DOMAINS)
+DOMAIN_PRIORITY_INDEX = DomainIndex(DOMAIN_PRIORITY)
+LOW_KEYWORD_MATCHER = KeywordMatcher(LOW_KEYWORDS)
+
 # ✅ 関数群
 def normalize_company(name):
     return name.replace("株式会社", "").replace(" ", "").replace("　", "").lower()
 
 def domain_score(url):
     url = url or ""
-    for domain in LOW_QUALITY_DOMAINS:
-        if domain in url:
-            return -100
-    for i, domain in enumerate(DOMAIN_PRIORITY):
-        if domain in url:
-            return len(DOMAIN_PRIORITY) - i
+    if url in LOW_QUALITY_INDEX:
+        return -100
+    rank = DOMAIN_PRIORITY_INDEX.match(url)
+    if rank is not None:
+        return len(DOMAIN_PRIORITY) - rank
     return 0
 
 def is_low_quality(snippet, url):
-    low_keywords = [
-        "商号変更とは", "社名変更とは", "会社名が変更になる場合は",
-        "法人登記", "やり方", "手続き", "無料相談", "注意点", "解説",
-        "法律事務所", "弁護士", "登記変更", "申請方法", "料金"
-    ]
     snippet = snippet or ""
     url = url or ""
-    if "bing.com/ck/a" in url:
-        return True
-    if any(domain in url for domain in LOW_QUALITY_DOMAINS):
+    # bing.com/ck/a（リダイレクト）もLOW_QUALITY_DOMAINSに含まれる
+    if url in LOW_QUALITY_INDEX:
         return True
-    for kw in low_keywords:
-        if kw in snippet or kw in url:
-            return True
-    return False
+    return LOW_KEYWORD_MATCHER.search(snippet) or LOW_KEYWORD_MATCHER.search(url)
 
 def clean_bing_redirect(url):
     from urllib.parse import unquote, urlparse, parse_qs
@@ -92,26 +109,41 @@ def result_score(company, title, snippet, url):
         score -= 3
     return score
 
+# ✅ 抽出パターン（優先順。モジュール読み込み時に1回だけコンパイル）
+NAME_PATTERNS = [
+    r'社名(?:を)?「?([^\s「」]{2,50})」?に変更',
+    r'新社名[は:]?「?([^\s「」]{2,50})」?',
+    r'「?([^\s「」]{2,50})株式会社」?に変更',
+    r'([^\s「」]{2,50})株式会社に変更',
+    r'新商号[は:]?\s*([^\s「」]{2,50})株式会社',
+    r'商号変更.*?([^\s「」]{2,50})株式会社',
+]
+# どのパターンも以下のいずれかを含まないと一致しない
+NAME_TRIGGERS = ("に変更", "新社名", "新商号", "商号変更")
+
+EXCLUDE_NAME_RE = re.compile("|".join(EXCLUDE_NAME_PATTERNS))
+NAME_RES = [re.compile(pat) for pat in NAME_PATTERNS]
+# 全パターンをまとめた1回の走査で候補の有無を判定する
+NAME_ANY_RE = re.compile("|".join(f"(?:{pat})" for pat in NAME_PATTERNS))
+DATE_RE = re.compile(r"(\d{4}年\d{1,2}月\d{1,2}日|\d{4}年\d{1,2}月|\d{4}年)")
+REASON_RE = re.compile(r"(?:理由は|変更理由は)([^。]{3,30})。")
+BAD_NAME_SET = frozenset(BAD_NAMES)
+
 def extract_info(text, old_name):
     text = text.replace("\n", "").replace("\r", "").strip()
-    if any(re.search(pat, text) for pat in EXCLUDE_NAME_PATTERNS):
+    if not any(trigger in text for trigger in NAME_TRIGGERS):
+        return None, None, None
+    if EXCLUDE_NAME_RE.search(text):
+        return None, None, None
+    if not NAME_ANY_RE.search(text):
         return None, None, None
-
-    name_patterns = [
-        r'社名(?:を)?「?([^\s「」]{2,50})」?に変更',
-        r'新社名[は:]?「?([^\s「」]{2,50})」?',
-        r'「?([^\s「」]{2,50})株式会社」?に変更',
-        r'([^\s「」]{2,50})株式会社に変更',
-        r'新商号[は:]?\s*([^\s「」]{2,50})株式会社',
-        r'商号変更.*?([^\s「」]{2,50})株式会社',
-    ]
 
     new_name = None
-    for pat in name_patterns:
-        m = re.search(pat, text)
+    for name_re in NAME_RES:
+        m = name_re.search(text)
         if m:
             g = m.group(1)
-            if g and g not in BAD_NAMES and not g.startswith("は"):
+            if g and g not in BAD_NAME_SET and not g.startswith("は"):
                 new_name = g
                 break
 
@@ -121,128 +153,637 @@ def extract_info(text, old_name):
     if normalize_company(old_name) in normalize_company(new_name):
         return None, None, None
 
-    date_match = re.search(r"(\d{4}年\d{1,2}月\d{1,2}日|\d{4}年\d{1,2}月|\d{4}年)", text)
+    date_match = DATE_RE.search(text)
     date = date_match.group(1) if date_match else "変更日不明"
 
-    reason_match = re.search(r"(?:理由は|変更理由は)([^。]{3,30})。", text)
+    reason_match = REASON_RE.search(text)
     reason = reason_match.group(1) if reason_match else "不明"
 
     return new_name, date, reason
 
-# ✅ キャッシュ
-def load_cache():
-    if os.path.exists(CACHE_FILE):
-        with open(CACHE_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
-
-def save_cache(cache):
-    with open(CACHE_FILE, "w", encoding="utf-8") as f:
-        json.dump(cache, f, ensure_ascii=False, indent=2)
+# ✅ ブラウザ1つ + 独立したコンテキスト/ページをN個用意
+# 軽量モード: 画像・フォント・CSS・計測タグを読み込まない
+LEAN_MODE = True
+LOAD_STATS = LoadStats()
+
+async def block_heavy_resources(route):
+    request = route.request
+    if request.resource_type in BLOCKED_RESOURCE_TYPES or any(host in request.url for host in TRACKER_HOSTS):
+        LOAD_STATS.add_blocked()
+        await route.abort()
+    else:
+        await route.continue_()
+
+async def new_search_page(browser):
+    context = await browser.new_context()
+    if LEAN_MODE:
+        await context.route("**/*", block_heavy_resources)
+    return await context.new_page()
+
+async def close_page(page):
+    try:
+        await page.context.close()
+    except Exception:
+        pass
 
 # ✅ Bing検索
-async def search_bing(playwright, company):
-    browser = await playwright.chromium.launch(headless=True)
-    page = await browser.new_page()
-    query = f"{company} 社名変更 OR 商号変更 OR 新社名"
-    url = f"https://www.bing.com/search?q={urllib.parse.quote(query)}"
-
-    await page.goto(url)
-    await page.wait_for_timeout(random.randint(1500, 4000))
-
-    elements = await page.query_selector_all("li.b_algo")
-    results = []
-    for elem in elements[:10]:
-        try:
-            title = await elem.query_selector("h2")
-            snippet_elem = await elem.query_selector(".b_caption")
-            link_elem = await elem.query_selector("a")
-
-            title_text = await title.inner_text() if title else ""
-            snippet_text = await snippet_elem.inner_text() if snippet_elem else ""
-            link_url = await link_elem.get_attribute("href") if link_elem else ""
+# 全ページ共通の速度制御（ページごとのランダム待機の代わり）
+RATE_LIMITER = AdaptiveRateLimiter()
+# 検索結果の表示待ちの上限（秒）。固定の待ち時間は置かない
+READY_TIMEOUT = DEFAULT_READY_TIMEOUT
+BING_URL = DEFAULT_BING_URL
+# 言い換えクエリ（off / delay / parallel）
+HEDGE_MODE = "off"
+HEDGE_DELAY = DEFAULT_HEDGE_DELAY
+QUERY_BUDGET = DEFAULT_QUERY_BUDGET
+# 失敗の分類ごとの再試行と、失敗が続いたら全ワーカーの検索を止めるブレーカー
+RETRY = RETRY_POLICIES
+BREAKER = CircuitBreaker()
+
+async def wait_until_ready(page, timeout):
+    try:
+        await page.wait_for_selector(READY_SELECTOR, state="attached", timeout=timeout * 1000)
+    except PlaywrightTimeoutError:
+        pass
 
-            results.append((title_text + "\n" + snippet_text, snippet_text, link_url))
-        except Exception:
-            continue
+async def record_page_load(page, seconds):
+    try:
+        transfer_bytes = await page.evaluate(f"() => {{ {TRANSFER_SIZE_JS} }}")
+    except Exception:
+        transfer_bytes = 0
+    LOAD_STATS.record(transfer_bytes, seconds)
+
+async def search_bing(page, company, query=None):
+    query = query or build_query(company)
+    url = build_search_url(query, BING_URL)
+
+    with METRICS.span("rate_wait"):
+        await RATE_LIMITER.acquire_async()
+    started = time.perf_counter()
+    with METRICS.span("navigate"):
+        await page.goto(url, wait_until="domcontentloaded")
+    with METRICS.span("ready_wait"):
+        await wait_until_ready(page, READY_TIMEOUT)
+    await record_page_load(page, time.perf_counter() - started)
+
+    with METRICS.span("scrape"):
+        elements = await page.query_selector_all("li.b_algo")
+        if not elements:
+            html = await page.content()
+            if is_block_page(html):
+                METRICS.count("block_page")
+                RATE_LIMITER.on_block("block page")
+                raise BlockPageError(f"Block page detected: {company}")
+            if not is_no_results_page(html):
+                # 表示待ちがタイムアウトした。「変更なし」として記録せず、再試行に回す
+                METRICS.count("empty_results")
+                RATE_LIMITER.on_block("empty results")
+                raise SerpTimeoutError(f"No results rendered within {READY_TIMEOUT:g}s: {company}")
+        RATE_LIMITER.on_success()
+        results = SearchResults(query=query)
+        for elem in elements[:10]:
+            try:
+                title = await elem.query_selector("h2")
+                snippet_elem = await elem.query_selector(".b_caption")
+                link_elem = await elem.query_selector("a")
+
+                title_text = await title.inner_text() if title else ""
+                snippet_text = await snippet_elem.inner_text() if snippet_elem else ""
+                link_url = await link_elem.get_attribute("href") if link_elem else ""
+
+                results.append((title_text + "\n" + snippet_text, snippet_text, link_url))
+            except Exception:
+                continue
+        if elements and not results:
+            raise SerpParseError(f"Could not parse results: {company}")
 
-    await browser.close()
     return results
 
-# ✅ 1社ずつ処理
-async def analyze_company(playwright, company):
-    cache = load_cache()
-    key = normalize_company(company)
-
-    if key in cache:
-        print(f"[CACHE HIT] {company}")
-        return cache[key]
-
-    try:
-        print(f"[SEARCH] {company}")
-        results = await search_bing(playwright, company)
-
-        results_sorted = sorted(
-            [r for r in results if not is_low_quality(r[1], r[2])],
-            key=lambda x: result_score(company, x[0], x[1], x[2]),
-            reverse=True
-        )
-
-        for full_text, snippet, url in results_sorted:
-            cleaned_url = clean_bing_redirect(url)
-            new_name, date, reason = extract_info(full_text, company)
-            if new_name:
-                result = [company, new_name, date, reason, "変更あり", snippet or "なし", cleaned_url or ""]
-                cache[key] = result
-                save_cache(cache)
-                return result
-
-        if results_sorted:
-            snippet = results_sorted[0][1] or "なし"
-            cleaned_url = clean_bing_redirect(results_sorted[0][2]) or ""
+# ✅ Playwrightバックエンド（ブラウザ1つ + ページN枚を使い回す）
+# ページ（コンテキスト）は RECYCLE_PAGES 回使ったら、メモリが MAX_RSS を超えたらブラウザごと作り直す。
+# どちらも代わりを起動し終えてから古いものと入れ替えるので、入れ替え中も検索は止まらない。
+RECYCLE_PAGES = 500
+MAX_RSS = 0
+RSS_CHECK_EVERY = 20  # メモリを測る間隔（検索回数）
+
+class PlaywrightBackend(AsyncSearchBackend):
+    name = "playwright"
+
+    def __init__(self, size, max_uses=0, max_rss=0):
+        self.size = size
+        self.max_uses = max_uses
+        self.max_rss = max_rss
+        self._playwright = None
+        self.browser = None
+        self.pages = None
+        self._owner = {}  # ページ -> ブラウザ
+        self._uses = {}
+        self._fresh = {}  # 古いページ -> 起動済みの代わり（None は起動中）
+        self._spares = []  # 新しいブラウザのページ（使用中だった古いページが戻るたびに渡す）
+        self._tasks = set()
+        self._searches = 0
+        self._recycling = False
+
+    async def _launch(self):
+        with METRICS.span("browser_start"):
+            return await self._playwright.chromium.launch(headless=True)
+
+    async def _new_page(self, browser):
+        page = await new_search_page(browser)
+        self._owner[page] = browser
+        self._uses[page] = 0
+        return page
+
+    async def _close_page(self, page):
+        browser = self._owner.pop(page, None)
+        self._uses.pop(page, None)
+        fresh = self._fresh.pop(page, None)
+        await close_page(page)
+        if fresh is not None:
+            await self._close_page(fresh)
+        # 作り直す前のブラウザは、最後のページを閉じたら閉じる
+        if browser is not None and browser is not self.browser and browser not in self._owner.values():
+            try:
+                await browser.close()
+            except Exception:
+                pass
+
+    def _background(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"[WARN] Background task failed: {task.exception()}")
+
+    async def start(self):
+        self._playwright = await async_playwright().start()
+        self.browser = await self._launch()
+        self.pages = asyncio.Queue()
+        for _ in range(self.size):
+            self.pages.put_nowait(await self._new_page(self.browser))
+
+    # 代わりが起動済みなら入れ替える
+    def _swap(self, page):
+        fresh = self._fresh.get(page)
+        if fresh is None:
+            return page
+        del self._fresh[page]
+        METRICS.count("context_recycled")
+        self._background(self._close_page(page))
+        return fresh
+
+    async def _warm_page(self, page):
+        try:
+            fresh = await self._new_page(self.browser)
+        except Exception as e:
+            print(f"[WARN] Could not open a replacement page: {e}")
+            self._fresh.pop(page, None)
+            return
+        if page in self._fresh:
+            self._fresh[page] = fresh
         else:
-            snippet = "なし"
-            cleaned_url = ""
-
-        result = [company, "変更なし", "変更日不明", "不明", "変更なし", snippet, cleaned_url]
-        cache[key] = result
-        save_cache(cache)
-        return result
-
-    except Exception as e:
-        print(f"[ERROR] {company}: {e}")
-        return [company, "エラー", "不明", "不明", "処理失敗", str(e), ""]
+            await self._close_page(fresh)
+
+    # 検索を終えたページを戻す（古いブラウザのページなら新しいブラウザのページと取り替える）
+    def _release(self, page):
+        if self._owner.get(page) is not self.browser:
+            self._background(self._close_page(page))
+            if self._spares:
+                page = self._spares.pop()
+            else:
+                self._background(self._put_new_page())
+                return
+        else:
+            self._uses[page] += 1
+            if self.max_uses and self._uses[page] >= self.max_uses and page not in self._fresh:
+                self._fresh[page] = None
+                self._background(self._warm_page(page))
+            page = self._swap(page)
+        self.pages.put_nowait(page)
+        self._searches += 1
+        if self._searches % RSS_CHECK_EVERY == 0:
+            self._background(self._check_rss())
+
+    # 枠を1つ戻す。新しいページを開けない（ブラウザが落ちた）ときはブラウザごと作り直し、
+    # それも失敗したら待ってやり直す。枠を失うと pages.get() が永久に待つので、諦めない。
+    async def _put_new_page(self):
+        delay = 1.0
+        while True:
+            if self._spares:
+                page = self._spares.pop()
+                break
+            try:
+                page = await self._new_page(self.browser)
+                break
+            except Exception as e:
+                print(f"[WARN] Could not open a new page: {e}")
+            if not self._recycling:
+                await self._recycle_browser("could not open a page")
+                if self._spares:
+                    continue
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+        self.pages.put_nowait(page)
+
+    # 落ちたページを閉じて、代わりのページで枠を戻す
+    async def _replace_page(self, page):
+        try:
+            await self._close_page(page)
+        finally:
+            await self._put_new_page()
+
+    async def _check_rss(self):
+        rss = await asyncio.to_thread(rss_bytes)
+        METRICS.gauge("rss_bytes", rss, "browser")
+        if self.max_rss and rss > self.max_rss and not self._recycling:
+            await self._recycle_browser(f"RSS {rss / 1e6:.0f}MB")
+
+    async def _recycle_browser(self, reason):
+        self._recycling = True
+        try:
+            print(f"[RECYCLE] Restarting browser ({reason})")
+            browser = await self._launch()
+            pages = [await self._new_page(browser) for _ in range(self.size)]
+            self.browser = browser
+            METRICS.count("browser_recycled")
+            # 空いている古いページはすぐに、使用中のものは戻ってきたときに取り替える
+            idle = []
+            while not self.pages.empty():
+                idle.append(self.pages.get_nowait())
+            for _ in idle:
+                self.pages.put_nowait(pages.pop())
+            self._spares = pages
+            # 古いブラウザは最後のページを閉じたときに閉じる（_close_page）
+            for page in idle:
+                await self._close_page(page)
+        except Exception as e:
+            print(f"[WARN] Browser restart failed: {e}")
+        finally:
+            self._recycling = False
+
+    async def search(self, company, query=None):
+        # 空きページ待ちがそのまま同時実行数の上限になる
+        page = await self.pages.get()
+        try:
+            return await search_bing(page, company, query)
+        except Exception:
+            if page.is_closed():
+                # ページかブラウザが落ちた。代わりは後ろで用意し、枠は _replace_page が必ず戻す
+                self._background(self._replace_page(page))
+                page = None
+            raise
+        finally:
+            if page is not None:
+                self._release(page)
+
+    async def close(self):
+        try:
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            browsers = set(self._owner.values())
+            if self.browser is not None:
+                browsers.add(self.browser)
+            for page in list(self._owner):
+                await close_page(page)
+            for browser in browsers:
+                await browser.close()
+        finally:
+            if self._playwright is not None:
+                await self._playwright.stop()
+
+def open_backend(name, concurrency):
+    if name == "http":
+        backend = ThreadedAsyncBackend(HttpBackend(concurrency, RATE_LIMITER, BING_URL, stats=LOAD_STATS))
+    else:
+        backend = PlaywrightBackend(concurrency, RECYCLE_PAGES, MAX_RSS)
+    backend = AsyncResilientBackend(backend, BREAKER, RETRY)
+    if HEDGE_MODE != "off":
+        # 再試行はヘッジの内側（言い換えごとに再試行し、合計は --query-budget 回まで）
+        backend = AsyncHedgedBackend(backend, is_confident, HEDGE_MODE, HEDGE_DELAY, QUERY_BUDGET)
+    return backend
+
+# ✅ 検索結果から判定する（副作用なし。プロセスプールでも動く）
+def decide(company, results):
+    results_sorted = sorted(
+        [r for r in results if not is_low_quality(r[1], r[2])],
+        key=lambda x: result_score(company, x[0], x[1], x[2]),
+        reverse=True
+    )
+
+    for full_text, snippet, url in results_sorted:
+        cleaned_url = clean_bing_redirect(url)
+        new_name, date, reason = extract_info(full_text, company)
+        if new_name:
+            return [company, new_name, date, reason, "変更あり", snippet or "なし", cleaned_url or ""]
+
+    if results_sorted:
+        snippet = results_sorted[0][1] or "なし"
+        cleaned_url = clean_bing_redirect(results_sorted[0][2]) or ""
+    else:
+        snippet = "なし"
+        cleaned_url = ""
+
+    return [company, "変更なし", "変更日不明", "不明", "変更なし", snippet, cleaned_url]
+
+# ✅ 判定ルールの指紋（キャッシュの各行に記録し、--reextract で古い行だけ判定し直す）
+RULES_VERSION = rule_fingerprint(
+    [DOMAIN_PRIORITY, LOW_QUALITY_DOMAINS, LOW_KEYWORDS, EXCLUDE_NAME_PATTERNS, BAD_NAMES,
+     NAME_PATTERNS, list(NAME_TRIGGERS), DATE_RE.pattern, REASON_RE.pattern],
+    [normalize_company, split_url, DomainIndex, KeywordMatcher, domain_score, is_low_quality, clean_bing_redirect,
+     result_score, extract_info, decide],
+)
+
+# 言い換えを打ち切ってよい結果（社名変更が見つかった）
+def is_confident(company, results):
+    return decide(company, results)[4] == "変更あり"
+
+def failed_result(company, e):
+    METRICS.count("error")
+    print(f"[ERROR] {company}: {e}")
+    return [company, "エラー", "不明", "不明", "処理失敗", str(e), ""]
+
+def cached_result(company, cache):
+    cached = cache.get(normalize_company(company))
+    if cached is None:
+        METRICS.count("cache_miss")
+        return None
+    METRICS.count("cache_hit")
+    print(f"[CACHE HIT] {company}")
+    # 表記違いの会社名で記録された結果でも、出力はこの行の会社名にする
+    return [company] + cached[1:]
+
+async def aiter_rows(rows):
+    for row in rows:
+        yield row
+
+# ✅ 全社を並列処理
+# rows は (行番号, 会社名) を順に返すイテラブル。
+# 検索 → 判定 → 書き込み を別々の段で処理する。判定はイベントループの外
+# （スレッド、cpu_pool を渡せば別プロセス）で行うので、抽出処理中もページ操作は止まらない。
+# 段の間の待ち行列に上限を設けて少しずつ流し込むので、入力がいくら大きくてもメモリは一定。
+# snapshots を渡すと検索結果の生データも保存する。
+async def process_all(rows, backend, cache, on_result, cpu_workers=1, cpu_pool=None, snapshots=None):
+    concurrency = backend.size
+    loop = asyncio.get_running_loop()
+    progress = tqdm()
+    waiting = {}  # 正規化名 -> 結果待ちの重複行
+    duplicates = 0
+
+    # results は検索した場合のみ（キャッシュヒット・検索失敗は None）
+    async def write(item):
+        row_no, company, key, result, store, results = item
+        if store:
+            with METRICS.span("cache_write"):
+                cache.put(key, result)
+        if snapshots is not None and results is not None:
+            with METRICS.span("snapshot_write"):
+                snapshots.put(key, company, getattr(results, "query", None), results)
+        on_result(row_no, result)
+        progress.update()
+        for dup_row_no, dup_company in waiting.pop(key, []):
+            on_result(dup_row_no, [dup_company] + result[1:])
+            progress.update()
+
+    async def judge(item):
+        row_no, company, key, results = item
+        try:
+            with METRICS.span("extract"):
+                result = await loop.run_in_executor(cpu_pool, decide, company, results)
+            METRICS.count("changed" if result[4] == "変更あり" else "unchanged")
+        except Exception as e:
+            result = failed_result(company, e)
+        await sink.put((row_no, company, key, result, True, results))
+
+    async def fetch(item):
+        row_no, company, key = item
+        cached = cached_result(company, cache)
+        if cached is not None:
+            await sink.put((row_no, company, key, cached, False, None))
+            return
+        try:
+            print(f"[SEARCH] {company}")
+            with METRICS.span("search"):
+                results = await backend.search(company)
+        except Exception as e:
+            await sink.put((row_no, company, key, failed_result(company, e), True, None))
+            return
+        await cpu.put((row_no, company, key, results))
+
+    sink = AsyncStage("sink", write, 1, concurrency * 4)
+    cpu = AsyncStage("cpu", judge, cpu_workers, concurrency * 2)
+    # キャッシュヒットは検索枠を使わないので、検索段のタスクは同時実行数より多めに置く
+    searcher = AsyncStage("fetch", fetch, concurrency * 2, concurrency * 4)
+    stages = [searcher, cpu, sink]
+    if not hasattr(rows, "__aiter__"):
+        rows = aiter_rows(rows)
+    try:
+        async for row_no, company in rows:
+            # 正規化名が同じ行は1回だけ検索し、結果を重複行にも配る
+            key = normalize_company(company)
+            if key in waiting:
+                waiting[key].append((row_no, company))
+                duplicates += 1
+                continue
+            waiting[key] = []
+            await searcher.put((row_no, company, key))
+    finally:
+        # 前の段から順に、投入済みの分を処理し終えて止める
+        for stage in stages:
+            await stage.close()
+        progress.close()
+    raise_stage_errors(stages)
+    if duplicates:
+        print(f"Duplicate rows merged: {duplicates}")
+
+# ✅ 期限切れキャッシュの再検索
+async def refresh_expired(cache, budget, backend_name, concurrency, cpu_workers=1, cpu_pool=None, snapshots=None):
+    expired = cache.expired(budget)
+    print(f"Expired entries: {len(expired)} (budget {budget})")
+    if not expired:
+        return
+    results = {}
+    async with open_backend(backend_name, concurrency) as backend:
+        await process_all(((i, row[0]) for i, (_, row) in enumerate(expired)), backend, cache, results.__setitem__,
+                          cpu_workers, cpu_pool, snapshots)
+    print(f"✅ Refreshed: {len(results)}")
+    print(LOAD_STATS.summary())
 
 # ✅ メイン
 async def main():
-    input_csv = "input.csv"
-    output_csv = "output.csv"
-
-    df = pd.read_csv(input_csv)
-    companies = df["会社名"].dropna().tolist()
-    print(f"Total companies: {len(companies)}")
-
-    results_dict = {}
-    all_results = []
-
-    async with async_playwright() as playwright:
-        for company in tqdm(companies):
-            result = await analyze_company(playwright, company)
-            key = normalize_company(company)
-            results_dict[key] = result
-            all_results.append(result)
-
-    df_out_rows = []
-    for company in companies:
-        key = normalize_company(company)
-        result = results_dict.get(key)
-        df_out_rows.append(result)
-
-    df_out = pd.DataFrame(df_out_rows, columns=[
-        "会社名", "新社名", "変更日", "変更理由", "変更状況", "検出文", "URL"
-    ])
-    df_out.to_csv(output_csv, index=False, encoding="utf-8-sig")
-    print(f"✅ Output saved: {output_csv}")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", nargs="?", default="input.csv", help="会社名CSVファイル")
+    parser.add_argument("output", nargs="?", default="output.csv", help="出力CSVファイル")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時に開くページ数")
+    parser.add_argument("--chunksize", type=int, default=1000, help="入力CSVを読む単位（行）")
+    parser.add_argument("--order", choices=["input", "completion"], default="input",
+                        help="最終出力の並び順（input: 入力順に並べ替え / completion: 完了順）")
+    add_ttl_arguments(parser)
+    add_resume_arguments(parser)
+    add_rate_arguments(parser)
+    add_backend_arguments(parser)
+    parser.add_argument("--no-lean", action="store_true", help="画像・CSSなども読み込む（転送量の比較用）")
+    parser.add_argument("--ready-timeout", type=float, default=DEFAULT_READY_TIMEOUT, help="検索結果の表示を待つ上限（秒）")
+    add_metrics_arguments(parser)
+    add_pipeline_arguments(parser)
+    add_snapshot_arguments(parser)
+    add_shard_arguments(parser)
+    add_queue_arguments(parser)
+    add_retry_arguments(parser)
+    add_recycle_arguments(parser)
+    args = parser.parse_args()
+    RATE_LIMITER.configure(rate=args.rate, max_rate=args.max_rate)
+    global READY_TIMEOUT, LEAN_MODE, BING_URL, HEDGE_MODE, HEDGE_DELAY, QUERY_BUDGET, RETRY, RECYCLE_PAGES, MAX_RSS
+    READY_TIMEOUT = args.ready_timeout
+    BING_URL = args.bing_url
+    HEDGE_MODE, HEDGE_DELAY, QUERY_BUDGET = args.hedge, args.hedge_delay, args.query_budget
+    RETRY = retry_policies(args)
+    RECYCLE_PAGES, MAX_RSS = args.recycle_pages, max_rss_from_args(args)
+    BREAKER.configure(window=args.breaker_window, threshold=args.breaker_threshold, cooldown=args.breaker_cooldown)
+    LEAN_MODE = LOAD_STATS.lean = not args.no_lean
+
+    if args.reprocess and args.no_snapshots:
+        parser.error("--reprocess と --no-snapshots は同時に指定できません")
+    if args.queue and args.attach:
+        parser.error("--queue と --attach は同時に指定できません")
+    if args.dry_run and not args.reextract:
+        parser.error("--dry-run は --reextract と一緒に指定してください")
+    # 分担実行ではキャッシュ・スナップショットも分担ごとのファイル
+    if args.shard is not None:
+        print(f"Shard: {format_shard(args.shard)}")
+    cache = open_cache(shard_path(CACHE_DB, args.shard), CACHE_FILE, ttl_from_args(args), RULES_VERSION)
+    snapshots = None if args.no_snapshots else SnapshotStore(shard_path(SNAPSHOT_DB, args.shard))
+    cpu_pool = open_cpu_pool(args)
+    if args.reextract:
+        try:
+            with tqdm(total=cache.count_stale()) as progress:
+                on_change = (lambda *change: progress.write(describe_change(*change))) if args.dry_run else None
+                total, changed, from_snapshots = reextract(cache, snapshots, decide, cpu_pool, progress=progress,
+                                                           dry_run=args.dry_run, on_change=on_change)
+        finally:
+            if cpu_pool is not None:
+                cpu_pool.shutdown()
+            if snapshots is not None:
+                snapshots.close()
+            cache.close()
+        done = "Dry run (nothing written)" if args.dry_run else "Re-extracted"
+        print(f"✅ {done} with rules {RULES_VERSION}: {total} (changed {changed}, from snapshots {from_snapshots})")
+        return
+
+    if args.reprocess:
+        try:
+            with tqdm(total=len(snapshots)) as progress:
+                total, changed = reprocess(snapshots, cache, decide, cpu_pool, progress=progress)
+        finally:
+            if cpu_pool is not None:
+                cpu_pool.shutdown()
+            snapshots.close()
+            cache.close()
+        print(f"✅ Reprocessed: {total} (changed {changed})")
+        return
+
+    if args.refresh:
+        reporter = MetricsReporter(METRICS, metrics_prefix(args), args.metrics_interval).start()
+        try:
+            await refresh_expired(cache, args.budget, args.backend, args.concurrency, args.cpu_workers, cpu_pool, snapshots)
+        finally:
+            if snapshots is not None:
+                snapshots.close()
+            if cpu_pool is not None:
+                cpu_pool.shutdown()
+            cache.close()
+            reporter.close()
+        print(METRICS.report())
+        return
+
+    print(f"Concurrency: {args.concurrency}")
+
+    lessee = None
+    try:
+        if args.queue or args.attach:
+            manifest, lessee = open_queue(args, args.chunksize)
+            rows = lessee.arows()
+        else:
+            manifest, rows = open_run(args, args.chunksize)
+    except ValueError as e:
+        parser.error(str(e))
+    manifest_shard = manifest.shard
+    prefix = metrics_prefix(args, manifest)
+    if args.attach:
+        if not args.metrics:
+            prefix += f".{lessee.worker}"
+        print(f"Attached to {manifest.run_id} as {lessee.worker}")
+        print(f"Metrics: {prefix}.json / {prefix}.prom")
+        reporter = MetricsReporter(METRICS, prefix, args.metrics_interval).start()
+        lessee.start()
+        try:
+            async with open_backend(args.backend, args.concurrency) as backend:
+                await process_all(rows, backend, cache, manifest.finish, args.cpu_workers, cpu_pool, snapshots)
+        finally:
+            lessee.close()
+            if snapshots is not None:
+                snapshots.close()
+            if cpu_pool is not None:
+                cpu_pool.shutdown()
+            cache.close()
+            counts = manifest.counts()
+            manifest.close()
+            reporter.close()
+        print(f"✅ Worker finished: {lessee.leased} rows (row states: {counts})")
+        print(METRICS.report())
+        return
+
+    print(f"Run ID: {manifest.run_id} (resume with --resume {manifest.run_id})")
+    if lessee is not None:
+        print(f"Work queue: other processes can join with --attach {manifest.run_id}")
+    output = manifest.output_path
+
+    # 完了した行から順に途中ファイルへ追記する
+    partial = partial_path(output)
+    print(f"Partial output: {partial}")
+    print(f"Metrics: {prefix}.json / {prefix}.prom")
+    reporter = MetricsReporter(METRICS, prefix, args.metrics_interval).start()
+    if lessee is not None:
+        lessee.start()
+    try:
+        with IncrementalWriter(partial) as writer:
+            if writer.is_new:
+                # 途中ファイルが無くなっていたら完了済みの行をマニフェストから戻す
+                for row_no, result in manifest.done_results():
+                    writer.write(row_no, result)
+
+            def on_result(row_no, result):
+                writer.write(row_no, result)
+                manifest.finish(row_no, result)
+
+            async with open_backend(args.backend, args.concurrency) as backend:
+                await process_all(rows, backend, cache, on_result, args.cpu_workers, cpu_pool, snapshots)
+            if lessee is not None:
+                # 他のワーカーが処理した行も途中ファイルに入れる
+                for row_no, result in manifest.results_from_others(lessee.worker):
+                    writer.write(row_no, result)
+    finally:
+        if lessee is not None:
+            lessee.close()
+        if snapshots is not None:
+            snapshots.close()
+        if cpu_pool is not None:
+            cpu_pool.shutdown()
+        cache.close()
+        counts = manifest.counts()
+        manifest.close()
+        # キャッシュの最終書き込みまで含めて書き出す
+        reporter.close()
+    print(f"Row states: {counts}")
+    print(LOAD_STATS.summary())
+    print(METRICS.report())
+
+    count = finalize_output(partial, output, args.order, row_numbers=manifest_shard is not None)
+    os.remove(partial)
+    print(f"✅ Output saved: {output} ({count} companies)")
 
 # ✅ エントリーポイント
 if __name__ == "__main__":
@@ -0,0 +1,143 @@
+import os
+import csv
+import heapq
+import tempfile
+import itertools
+import threading
+import pandas as pd
+
+OUTPUT_COLUMNS = ["会社名", "新社名", "変更日", "変更理由", "変更状況", "検出文", "URL"]
+ROW_COLUMN = "行番号"
+
+
+# ✅ 入力CSVを少しずつ読む（行番号は入力の並び順、空欄の行は飛ばす）
+def iter_companies(path, chunksize=1000):
+    row_no = 0
+    for chunk in pd.read_csv(path, usecols=["会社名"], chunksize=chunksize):
+        for company in chunk["会社名"]:
+            if not pd.isna(company):
+                yield row_no, str(company)
+            row_no += 1
+
+
+def partial_path(output_path):
+    return output_path + ".partial"
+
+
+# ✅ 結果を1行ずつ追記する（途中経過もそのまま読める）
+class IncrementalWriter:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.is_new = new_file
+        self._f = open(path, "a", encoding="utf-8-sig" if new_file else "utf-8", newline="")
+        self._writer = csv.writer(self._f)
+        if new_file:
+            self._writer.writerow([ROW_COLUMN] + OUTPUT_COLUMNS)
+            self._f.flush()
+
+    def write(self, row_no, result):
+        with self._lock:
+            self._writer.writerow([row_no] + list(result))
+            self._f.flush()
+
+    def close(self):
+        with self._lock:
+            self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ✅ 途中ファイルを行番号順に並べ替える（メモリに載せるのは run_rows 行まで）
+# run_rows 行ずつ並べ替えて一時ファイルに書き、最後にまとめて突き合わせる。
+# 返すのは (行番号, 途中ファイルでの位置, 行) で、同じ行番号は位置の順に並ぶ。
+# 複数のファイル（分担ごとの出力など）を渡したときは、位置はファイルの順に続けて数える。
+SORT_RUN_ROWS = 100_000
+
+
+def _numbered_rows(paths):
+    i = 0
+    for path in paths:
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for row in reader:
+                yield int(row[0]), i, row
+                i += 1
+
+
+def _sorted_runs(paths, run_rows, tmp_dir):
+    runs = []
+    numbered = _numbered_rows(paths)
+    while True:
+        chunk = list(itertools.islice(numbered, run_rows))
+        if not chunk:
+            break
+        chunk.sort(key=lambda item: item[:2])
+        run = tempfile.TemporaryFile("w+", encoding="utf-8", newline="", dir=tmp_dir)
+        csv.writer(run).writerows([i] + row for _, i, row in chunk)
+        run.seek(0)
+        runs.append(run)
+    return runs
+
+
+def _read_run(run):
+    for row in csv.reader(run):
+        yield int(row[1]), int(row[0]), row[1:]
+
+
+def sorted_partial_rows(partial, run_rows=SORT_RUN_ROWS, tmp_dir=None):
+    paths = [partial] if isinstance(partial, str) else partial
+    runs = _sorted_runs(paths, run_rows, tmp_dir)
+    try:
+        yield from heapq.merge(*(_read_run(run) for run in runs))
+    finally:
+        for run in runs:
+            run.close()
+
+
+# ✅ 途中ファイル（複数可）を行番号順に並べ、行番号ごとに最後の結果だけを書く
+def write_sorted_output(partial, output_path, row_numbers=False):
+    columns = [ROW_COLUMN] + OUTPUT_COLUMNS if row_numbers else OUTPUT_COLUMNS
+    count = 0
+    tmp_dir = os.path.dirname(os.path.abspath(output_path))
+    with open(output_path, "w", encoding="utf-8-sig", newline="") as dst:
+        writer = csv.writer(dst)
+        writer.writerow(columns)
+        rows = sorted_partial_rows(partial, tmp_dir=tmp_dir)
+        for _, group in itertools.groupby(rows, key=lambda item: item[0]):
+            *_, (_, _, row) = group
+            writer.writerow(row if row_numbers else row[1:])
+            count += 1
+    return count
+
+
+# ✅ 途中ファイルから最終出力を作る
+# order="input" なら入力順に並べ替え、"completion" なら完了順のまま流し込む。
+# 同じ行番号が複数あるとき（再実行時など）は最後の結果を使う。
+# row_numbers=True なら行番号の列を残す（分担実行の出力を後でまとめるため）。
+def finalize_output(partial, output_path, order="input", row_numbers=False):
+    if order == "input":
+        return write_sorted_output(partial, output_path, row_numbers)
+
+    columns = [ROW_COLUMN] + OUTPUT_COLUMNS if row_numbers else OUTPUT_COLUMNS
+    last_line = {}
+    with open(partial, encoding="utf-8-sig", newline="") as f:
+        for i, row in enumerate(csv.reader(f)):
+            if i:
+                last_line[row[0]] = i
+    count = 0
+    with open(partial, encoding="utf-8-sig", newline="") as src, \
+            open(output_path, "w", encoding="utf-8-sig", newline="") as dst:
+        writer = csv.writer(dst)
+        writer.writerow(columns)
+        for i, row in enumerate(csv.reader(src)):
+            if i and last_line.get(row[0]) == i:
+                writer.writerow(row if row_numbers else row[1:])
+                count += 1
+    return count
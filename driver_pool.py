@@ -0,0 +1,166 @@
+import queue
+import logging
+import threading
+from contextlib import contextmanager
+from metrics import METRICS
+
+
+# ✅ ドライバープール（起動済みのブラウザを使い回す）
+# max_uses 回使うか、rss(driver) が max_rss バイトを超えたドライバーは作り直す。
+# 代わりは別スレッドで起動しておき、起動し終わってから古いものと入れ替える
+# （入れ替えまでは古いドライバーが検索を続けるので、処理が止まらない）。
+class DriverPool:
+    def __init__(self, factory, size, max_uses=0, max_rss=0, rss=None, check_every=10):
+        self.factory = factory
+        self.size = size
+        self.max_uses = max_uses
+        self.max_rss = max_rss
+        self.rss = rss
+        self.check_every = check_every
+        # 温まったドライバーを優先して貸し出す
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._live = set()
+        self._closed = False
+        self._names = {}  # ドライバー -> メトリクス上の名前
+        self._uses = {}
+        self._replacements = {}  # 古いドライバー -> 起動済みの代わり（None は起動中）
+        self._started = 0
+        self.peak_rss = 0  # ドライバー1つあたりの最大（マシンの大きさを決める材料）
+        # 空きスロット（None）は最初のリース時に起動する
+        for _ in range(size):
+            self._idle.put(None)
+
+    def _create(self):
+        driver = self.factory()
+        with self._lock:
+            self._started += 1
+            self._live.add(driver)
+            self._names[driver] = f"driver-{self._started}"
+            self._uses[driver] = 0
+        return driver
+
+    def _discard(self, driver):
+        with self._lock:
+            self._live.discard(driver)
+            name = self._names.pop(driver, None)
+            self._uses.pop(driver, None)
+            replacement = self._replacements.pop(driver, None)
+        if name is not None:
+            METRICS.clear_gauge("rss_bytes", name)
+        try:
+            driver.quit()
+        except Exception as e:
+            logging.debug(f"ドライバー終了エラー: {e}")
+        # 壊れて捨てたドライバーの代わりが起動済みなら、それも閉じる（スロットは次のリースで起動する）
+        if replacement is not None:
+            self._discard(replacement)
+
+    @staticmethod
+    def is_alive(driver):
+        try:
+            driver.execute_script("return 1")
+            return True
+        except Exception:
+            return False
+
+    # 使用回数とメモリを見て、作り直しが必要なら代わりの起動を始める
+    def _after_use(self, driver):
+        with self._lock:
+            uses = self._uses[driver] = self._uses.get(driver, 0) + 1
+            name = self._names.get(driver)
+            if driver in self._replacements:
+                return
+        reason = None
+        if self.max_uses and uses >= self.max_uses:
+            reason = f"{uses}回使用"
+        if self.rss is not None and (uses % self.check_every == 0 or reason):
+            rss = self.rss(driver)
+            METRICS.gauge("rss_bytes", rss, name)
+            if rss > self.peak_rss:
+                self.peak_rss = rss
+                METRICS.gauge("driver_rss_peak_bytes", rss)
+            if self.max_rss and rss > self.max_rss:
+                reason = f"メモリ {rss / 1e6:.0f}MB"
+        if reason is None:
+            return
+        with self._lock:
+            if driver in self._replacements or self._closed:
+                return
+            self._replacements[driver] = None
+        logging.info(f"ドライバーを作り直します（{name}: {reason}）")
+        threading.Thread(target=self._warm, args=(driver,), name="driver-warm", daemon=True).start()
+
+    def _warm(self, old):
+        try:
+            with METRICS.span("driver_recycle"):
+                new = self._create()
+        except Exception as e:
+            logging.warning(f"代わりのドライバーを起動できません: {e}")
+            with self._lock:
+                self._replacements.pop(old, None)
+            return
+        with self._lock:
+            keep = not self._closed and old in self._live and old in self._replacements
+            if keep:
+                self._replacements[old] = new
+        if not keep:
+            self._discard(new)
+
+    # 代わりが起動済みなら入れ替える（古いものは別スレッドで終了する）
+    def _swap(self, driver):
+        if driver is None:
+            return None
+        with self._lock:
+            new = self._replacements.get(driver)
+            if new is None:
+                return driver
+            del self._replacements[driver]
+        METRICS.count("driver_recycled")
+        threading.Thread(target=self._discard, args=(driver,), name="driver-retire", daemon=True).start()
+        return new
+
+    @contextmanager
+    def lease(self):
+        if self._closed:
+            raise RuntimeError("DriverPool is closed")
+        driver = self._idle.get()
+        try:
+            driver = self._swap(driver)
+            if driver is not None and not self.is_alive(driver):
+                logging.warning("ドライバー応答なし: 再起動します")
+                self._discard(driver)
+                driver = None
+            if driver is None:
+                driver = self._create()
+        except Exception:
+            # 起動に失敗してもスロットは返却する
+            self._idle.put(None)
+            raise
+
+        healthy = True
+        try:
+            yield driver
+        except Exception:
+            healthy = self.is_alive(driver)
+            raise
+        finally:
+            if self._closed or not healthy:
+                self._discard(driver)
+                self._idle.put(None)
+            else:
+                self._after_use(driver)
+                self._idle.put(self._swap(driver))
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            drivers = list(self._live)
+        for driver in drivers:
+            self._discard(driver)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,234 @@
+import json
+import time
+import html
+import random
+import hashlib
+import argparse
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# ✅ Bingの代わりに検索結果ページを返すローカルサーバー（負荷試験用）
+# 実Bingに触れずに process_all や main() を試すためのもの。
+# 遅延・エラー率・ブロック率・結果なし率を設定できる。
+
+QUERY_SUFFIX = " 社名変更 OR 商号変更 OR 新社名"
+HEDGE_SUFFIXES = (" 新商号", " 旧社名")
+
+RESULT_TEMPLATE = (
+    '<li class="b_algo"><h2><a href="{url}">{title}</a></h2>'
+    '<div class="b_caption"><p>{snippet}</p></div></li>'
+)
+PAGE_TEMPLATE = (
+    '<!DOCTYPE html><html lang="ja"><head><meta charset="utf-8"><title>{query} - 検索</title>'
+    '<link rel="stylesheet" href="/static/serp.css"></head>'
+    '<body><ol id="b_results">{results}</ol><img src="/static/logo.png"></body></html>'
+)
+NO_RESULTS_PAGE = (
+    '<!DOCTYPE html><html lang="ja"><head><meta charset="utf-8"></head>'
+    '<body><ol id="b_results"><li class="b_no"><h1>一致する検索結果はありません</h1></li></ol></body></html>'
+)
+BLOCK_PAGE = (
+    '<!DOCTYPE html><html><head><meta charset="utf-8"></head>'
+    '<body><div id="b_captcha">Our systems have detected unusual traffic. captcha</div></body></html>'
+)
+
+SYNTHETIC_DOMAINS = [
+    "https://prtimes.jp/main/html/rd/p/{n}.html",
+    "https://www.nikkei.com/article/DGX{n}/",
+    "https://www.example.co.jp/news/{n}.html",
+    "https://note.com/user/n/{n}",
+    "https://kaisha-info.example.com/{n}",
+]
+
+
+def normalize_company(name):
+    return name.replace("株式会社", "").replace(" ", "").replace("　", "").lower()
+
+
+# 通常のクエリ・言い換えクエリ（search_backends.build_hedge_queries）から会社名を取り出す
+def company_from_query(query):
+    query = query.split(QUERY_SUFFIX)[0]
+    for suffix in HEDGE_SUFFIXES:
+        if query.endswith(suffix):
+            query = query[:-len(suffix)]
+    return query.strip().strip('"')
+
+
+class FakeBingConfig:
+    def __init__(self, latency_ms=300, jitter_ms=200, error_rate=0.0, block_rate=0.0,
+                 empty_rate=0.05, change_rate=0.3, corpus=None, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.block_rate = block_rate
+        self.empty_rate = empty_rate
+        self.change_rate = change_rate
+        self.corpus = corpus or {}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "ok": 0, "error": 0, "block": 0, "empty": 0}
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def roll(self):
+        with self.lock:
+            return self.random.random()
+
+
+# ✅ 記録済みのキャッシュ（bing_cache_*.json）から会社ごとの結果を作る
+def load_corpus(path):
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    corpus = {}
+    for key, row in data.items():
+        title = row[0] if row[1] in ("変更なし", "エラー") else f"{row[0]} {row[1]}"
+        corpus[normalize_company(row[0])] = [(title, row[5], row[6])]
+    return corpus
+
+
+NEW_NAME_WORDS = ["ミライ", "ネクサス", "アルファ", "ソレイユ", "フロンティア", "ブライト", "ハーモニー", "アクシス"]
+NEW_NAME_SUFFIXES = ["ホールディングス", "テクノロジーズ", "パートナーズ", "ジャパン"]
+
+
+# 旧社名を含まない新社名（含んでいると、どちらのエンジンの extract_info も社名変更とみなさない）
+def synthetic_new_name(company, rnd):
+    old = normalize_company(company)
+    names = [word + suffix for word in NEW_NAME_WORDS for suffix in NEW_NAME_SUFFIXES]
+    rnd.shuffle(names)
+    return next((name for name in names if old not in normalize_company(name)), names[0])
+
+
+# ✅ 会社名から毎回同じ結果を作る（一部は社名変更ありにする）
+def synthetic_results(company, change_rate):
+    digest = int(hashlib.sha1(company.encode("utf-8")).hexdigest(), 16)
+    rnd = random.Random(digest)
+    results = []
+    changed = rnd.random() < change_rate
+    for i in range(10):
+        n = digest % 100000 + i
+        url = SYNTHETIC_DOMAINS[rnd.randrange(len(SYNTHETIC_DOMAINS))].format(n=n)
+        if i == 0 and changed:
+            new_name = synthetic_new_name(company, rnd)
+            title = f"{company} 新社名のお知らせ"
+            snippet = f"{company}は{2020 + rnd.randrange(5)}年{rnd.randrange(1, 13)}月1日付で社名を「{new_name}」に変更します。"
+        else:
+            title = f"{company} 会社概要 {i}"
+            snippet = f"{company}の会社概要、事業内容、所在地などを掲載しています。資本金 {rnd.randrange(1, 100)}億円。"
+        results.append((title, snippet, url))
+    return results
+
+
+def render_results(query, results):
+    items = "".join(
+        RESULT_TEMPLATE.format(url=html.escape(url or "", quote=True), title=html.escape(title), snippet=html.escape(snippet or ""))
+        for title, snippet, url in results
+    )
+    return PAGE_TEMPLATE.format(query=html.escape(query), results=items)
+
+
+def make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status, body, content_type="text/html; charset=utf-8"):
+            data = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            parts = urllib.parse.urlsplit(self.path)
+            if parts.path == "/stats":
+                with config.lock:
+                    return self._send(200, json.dumps(config.counts), "application/json")
+            if parts.path.startswith("/static/"):
+                return self._send(200, "", "text/plain")
+            if parts.path != "/search":
+                return self._send(404, "not found", "text/plain")
+
+            config.count("requests")
+            query = urllib.parse.parse_qs(parts.query).get("q", [""])[0]
+            delay = max(0.0, config.latency_ms + (config.roll() * 2 - 1) * config.jitter_ms) / 1000
+            time.sleep(delay)
+
+            roll = config.roll()
+            if roll < config.error_rate:
+                config.count("error")
+                return self._send(500, "internal error", "text/plain")
+            roll -= config.error_rate
+            if roll < config.block_rate:
+                config.count("block")
+                return self._send(200, BLOCK_PAGE)
+            roll -= config.block_rate
+            if roll < config.empty_rate:
+                config.count("empty")
+                return self._send(200, NO_RESULTS_PAGE)
+
+            company = company_from_query(query)
+            results = config.corpus.get(normalize_company(company)) or synthetic_results(company, config.change_rate)
+            config.count("ok")
+            return self._send(200, render_results(query, results))
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def make_server(config, host="127.0.0.1", port=0):
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    return server
+
+
+# ✅ 別スレッドで起動して検索URLを返す（負荷試験ハーネス用）
+def serve_in_thread(config, host="127.0.0.1", port=0):
+    server = make_server(config, host, port)
+    thread = threading.Thread(target=server.serve_forever, name="fake-bing", daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}/search"
+
+
+def add_server_arguments(parser):
+    parser.add_argument("--latency-ms", type=float, default=300, help="応答までの平均遅延（ミリ秒）")
+    parser.add_argument("--jitter-ms", type=float, default=200, help="遅延のばらつき（±ミリ秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="HTTP 500を返す割合")
+    parser.add_argument("--block-rate", type=float, default=0.0, help="ブロックページを返す割合")
+    parser.add_argument("--empty-rate", type=float, default=0.05, help="「結果なし」を返す割合")
+    parser.add_argument("--change-rate", type=float, default=0.3, help="合成結果のうち社名変更ありにする割合")
+    parser.add_argument("--corpus", help="結果に使う記録済みキャッシュ（bing_cache_*.json）")
+    parser.add_argument("--seed", type=int, help="乱数シード")
+
+
+def config_from_args(args):
+    return FakeBingConfig(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+        block_rate=args.block_rate, empty_rate=args.empty_rate, change_rate=args.change_rate,
+        corpus=load_corpus(args.corpus) if args.corpus else None, seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bing検索結果ページの代替サーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server = make_server(config_from_args(args), args.host, args.port)
+    print(f"Fake Bing: http://{args.host}:{args.port}/search （--bing-url に指定）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
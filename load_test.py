@@ -0,0 +1,190 @@
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+import contextlib
+from cache_store import CacheStore, CacheWriter
+from metrics import METRICS
+from memory_usage import PeakRssSampler
+from rate_limiter import AdaptiveRateLimiter
+from resilience import CircuitBreaker, add_retry_arguments, retry_policies
+from search_backends import SearchBackend, AsyncSearchBackend, HEDGE_CHOICES, DEFAULT_HEDGE_DELAY, DEFAULT_QUERY_BUDGET
+from fake_bing_server import serve_in_thread, add_server_arguments, config_from_args
+
+# ✅ 負荷試験ハーネス
+# ローカルの代替サーバー（fake_bing_server）に向けて各エンジンを動かし、
+# 同時実行数ごとの処理速度・レイテンシ・メモリを測る。
+#   python load_test.py --engine threaded --backend http --concurrency 1,2,4,8
+
+
+class TimedBackend(SearchBackend):
+    def __init__(self, backend, latencies):
+        self.backend = backend
+        self.name = backend.name
+        self.size = backend.size
+        self.latencies = latencies
+
+    def search(self, company, query=None):
+        started = time.perf_counter()
+        try:
+            return self.backend.search(company, query)
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+
+    def close(self):
+        self.backend.close()
+
+
+class AsyncTimedBackend(AsyncSearchBackend):
+    def __init__(self, backend, latencies):
+        self.backend = backend
+        self.name = backend.name
+        self.size = backend.size
+        self.latencies = latencies
+
+    async def start(self):
+        await self.backend.start()
+
+    async def search(self, company, query=None):
+        started = time.perf_counter()
+        try:
+            return await self.backend.search(company, query)
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+
+    async def close(self):
+        await self.backend.close()
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def synthetic_companies(count):
+    for i in range(count):
+        yield i, f"株式会社テスト{i:06d}" if i % 2 else f"テスト{i:06d}株式会社"
+
+
+# ✅ エンジンの設定を試験用に差し替える（検索URL・速度制限）
+def configure_engine(module, args, bing_url):
+    module.BING_URL = bing_url
+    module.READY_TIMEOUT = args.ready_timeout
+    module.RATE_LIMITER = AdaptiveRateLimiter(rate=args.rate, max_rate=args.rate, min_rate=args.rate / 10)
+    module.HEDGE_MODE, module.HEDGE_DELAY, module.QUERY_BUDGET = args.hedge, args.hedge_delay, args.query_budget
+    module.RETRY = retry_policies(args)
+    module.BREAKER = CircuitBreaker(window=args.breaker_window, threshold=args.breaker_threshold,
+                                    cooldown=args.breaker_cooldown)
+
+
+def run_threaded(args, bing_url, concurrency, cache, latencies, results):
+    import check_company_name as engine
+    # 読み込み時の logging.basicConfig(level=INFO) で戻るので、読み込んだ後に抑え直す
+    logging.getLogger().setLevel(logging.WARNING)
+    configure_engine(engine, args, bing_url)
+    with TimedBackend(engine.open_backend(args.backend, concurrency), latencies) as backend:
+        engine.process_all(synthetic_companies(args.companies), backend, cache, results.__setitem__)
+
+
+def run_async(args, bing_url, concurrency, cache, latencies, results):
+    import company_name_change_checker as engine
+    configure_engine(engine, args, bing_url)
+
+    async def run():
+        async with AsyncTimedBackend(engine.open_backend(args.backend, concurrency), latencies) as backend:
+            await engine.process_all(synthetic_companies(args.companies), backend, cache, results.__setitem__)
+
+    asyncio.run(run())
+
+
+def run_level(args, bing_url, concurrency):
+    latencies = []
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        store = CacheStore(os.path.join(tmp, "cache.sqlite3"))
+        cache = CacheWriter(store)
+        runner = run_threaded if args.engine == "threaded" else run_async
+        METRICS.reset()
+        # エンジン側の1社ごとのログは抑える
+        with PeakRssSampler() as rss, contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            runner(args, bing_url, concurrency, cache, latencies, results)
+            elapsed = time.perf_counter() - started
+        cache.close()
+        store.close()
+
+    failed = sum(1 for r in results.values() if r[4] == "処理失敗")
+    return {
+        "concurrency": concurrency,
+        "companies": len(results),
+        "failed": failed,
+        "seconds": round(elapsed, 3),
+        "companies_per_sec": round(len(results) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "peak_rss_mb": round(rss.peak / 1024 / 1024, 1),
+        "stages": METRICS.summary()["stages"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ローカル代替サーバーを使った負荷試験")
+    parser.add_argument("--engine", choices=["threaded", "async"], default="threaded",
+                        help="threaded: check_company_name / async: company_name_change_checker")
+    parser.add_argument("--backend", choices=["browser", "http"], default="http")
+    parser.add_argument("--concurrency", default="1,2,4,8", help="試す同時実行数（カンマ区切り）")
+    parser.add_argument("--companies", type=int, default=200, help="1回の試験で処理する会社数")
+    parser.add_argument("--rate", type=float, default=1000.0, help="検索速度の上限（件/秒）。ペース配分を試すときに下げる")
+    parser.add_argument("--ready-timeout", type=float, default=10.0)
+    parser.add_argument("--hedge", choices=HEDGE_CHOICES, default="off")
+    parser.add_argument("--hedge-delay", type=float, default=DEFAULT_HEDGE_DELAY)
+    parser.add_argument("--query-budget", type=int, default=DEFAULT_QUERY_BUDGET)
+    parser.add_argument("--bing-url", help="起動済みの代替サーバーを使う（省略時はこのプロセス内で起動）")
+    parser.add_argument("--json-out", help="結果をJSONで保存する")
+    add_retry_arguments(parser)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    server = None
+    bing_url = args.bing_url
+    if not bing_url:
+        server, bing_url = serve_in_thread(config_from_args(args))
+    print(f"エンジン: {args.engine} / バックエンド: {args.backend} / 検索URL: {bing_url}")
+
+    rows = []
+    try:
+        for concurrency in [int(c) for c in args.concurrency.split(",") if c.strip()]:
+            row = run_level(args, bing_url, concurrency)
+            rows.append(row)
+            print(
+                f"同時実行 {row['concurrency']:>3}: {row['companies_per_sec']:>7.2f} 社/秒 "
+                f"p50 {row['p50_ms']:>7.1f}ms p95 {row['p95_ms']:>7.1f}ms p99 {row['p99_ms']:>7.1f}ms "
+                f"RSS {row['peak_rss_mb']:>7.1f}MB 失敗 {row['failed']}",
+                file=sys.stderr if args.json_out == "-" else sys.stdout,
+            )
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    if args.json_out:
+        text = json.dumps(rows, ensure_ascii=False, indent=2)
+        if args.json_out == "-":
+            print(text)
+        else:
+            with open(args.json_out, "w", encoding="utf-8") as f:
+                f.write(text)
+
+
+if __name__ == "__main__":
+    main()
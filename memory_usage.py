@@ -0,0 +1,73 @@
+import os
+import logging
+import threading
+
+try:
+    import psutil
+except ImportError:  # psutil が無ければ自プロセスの最大RSSだけを返す
+    psutil = None
+
+
+# ✅ 自プロセス（＋子プロセス＝ブラウザ）のRSS（バイト）
+def rss_bytes(include_children=True, pid=None):
+    if psutil is None:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    try:
+        proc = psutil.Process(pid or os.getpid())
+        total = proc.memory_info().rss
+        if include_children:
+            for child in proc.children(recursive=True):
+                try:
+                    total += child.memory_info().rss
+                except psutil.Error:
+                    continue
+        return total
+    except psutil.Error:
+        return 0
+
+
+# ✅ 一定間隔でRSSを測り、最大値を記録する
+class PeakRssSampler:
+    def __init__(self, interval=0.5, include_children=True):
+        self.interval = interval
+        self.include_children = include_children
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, rss_bytes(self.include_children))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = rss_bytes(self.include_children)
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_bytes(self.include_children))
+
+
+HAS_PSUTIL = psutil is not None
+
+
+# ✅ ブラウザの作り直し（長時間動かすとレンダラーのメモリが増え続けるため）
+def add_recycle_arguments(parser):
+    parser.add_argument("--recycle-pages", type=int, default=500,
+                        help="ブラウザ（Playwrightはページのコンテキスト）をこの回数使ったら作り直す（0で無効）")
+    parser.add_argument("--max-rss-mb", type=float, default=0,
+                        help="ブラウザのメモリ（RSS、MB）がこれを超えたら作り直す（0で無効、psutilが必要）")
+
+
+def max_rss_from_args(args):
+    if not args.max_rss_mb:
+        return 0
+    if not HAS_PSUTIL:
+        logging.warning("psutil が無いため --max-rss-mb は無効です（pip install psutil）")
+        return 0
+    return int(args.max_rss_mb * 1024 * 1024)
@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from memory_usage import rss_bytes
+
+# ✅ 処理段階ごとの所要時間とイベント数の集計
+# 例: with METRICS.span("navigate"): driver.get(url)
+#     METRICS.count("cache_hit")
+#     METRICS.gauge("rss_bytes", 512e6, worker="driver-1")
+# 集計結果はJSONとPrometheusのテキスト形式で書き出す（実行中は定期的に、終了時に最終版）。
+
+# ヒストグラムの区切り（秒）
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PROM_PREFIX = "company_checker"
+DEFAULT_INTERVAL = 30.0
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最後は +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    # 区切りの上端で近似した分位点
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else 0.0,
+            "p50": round(self.quantile(0.5), 6),
+            "p95": round(self.quantile(0.95), 6),
+            "p99": round(self.quantile(0.99), 6),
+            "max": round(self.max, 6),
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.stages = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    # 最新の値だけを持つ（ワーカーごとのメモリなど）
+    def gauge(self, name, value, worker=""):
+        with self._lock:
+            self.gauges.setdefault(name, {})[worker] = value
+
+    def clear_gauge(self, name, worker=""):
+        with self._lock:
+            self.gauges.get(name, {}).pop(worker, None)
+
+    # with の中の所要時間を記録する（await を挟んでもよい）
+    @contextmanager
+    def span(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.stages = {}
+            self.counters = {}
+            self.gauges = {}
+
+    def summary(self):
+        with self._lock:
+            return {
+                "started_at": self.started,
+                "elapsed": round(time.time() - self.started, 3),
+                "stages": {name: h.to_dict() for name, h in sorted(self.stages.items())},
+                "counters": dict(sorted(self.counters.items())),
+                "gauges": {name: dict(sorted(values.items())) for name, values in sorted(self.gauges.items())},
+            }
+
+    def to_prometheus(self):
+        lines = [
+            f"# HELP {PROM_PREFIX}_stage_seconds Time spent in each processing stage.",
+            f"# TYPE {PROM_PREFIX}_stage_seconds histogram",
+        ]
+        with self._lock:
+            for name, h in sorted(self.stages.items()):
+                cumulative = 0
+                for bound, n in zip(h.buckets + (float("inf"),), h.counts):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{PROM_PREFIX}_stage_seconds_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'{PROM_PREFIX}_stage_seconds_sum{{stage="{name}"}} {h.sum:.6f}')
+                lines.append(f'{PROM_PREFIX}_stage_seconds_count{{stage="{name}"}} {h.count}')
+            lines.append(f"# HELP {PROM_PREFIX}_events_total Number of events (cache hits, errors, block pages, ...).")
+            lines.append(f"# TYPE {PROM_PREFIX}_events_total counter")
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'{PROM_PREFIX}_events_total{{event="{name}"}} {value}')
+            for name, values in sorted(self.gauges.items()):
+                lines.append(f"# TYPE {PROM_PREFIX}_{name} gauge")
+                for worker, value in sorted(values.items()):
+                    label = f'{{worker="{worker}"}}' if worker else ""
+                    lines.append(f"{PROM_PREFIX}_{name}{label} {value}")
+        return "\n".join(lines) + "\n"
+
+    # 書きかけのファイルを読まれないよう、一時ファイルから置き換える
+    def write(self, prefix):
+        os.makedirs(os.path.dirname(os.path.abspath(prefix)), exist_ok=True)
+        for path, text in (
+            (f"{prefix}.json", json.dumps(self.summary(), ensure_ascii=False, indent=2)),
+            (f"{prefix}.prom", self.to_prometheus()),
+        ):
+            tmp = f"{path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp, path)
+
+    def report(self):
+        summary = self.summary()
+        parts = [
+            f"{name} 平均 {s['mean'] * 1000:.0f}ms / p95 {s['p95'] * 1000:.0f}ms ({s['count']}回)"
+            for name, s in summary["stages"].items()
+        ]
+        counters = ", ".join(f"{name}={value}" for name, value in summary["counters"].items())
+        text = "段階別の所要時間: " + ("; ".join(parts) or "なし") + (f"\nイベント: {counters}" if counters else "")
+        rss = summary["gauges"].get("rss_bytes")
+        if rss:
+            text += "\nメモリ（RSS）: " + ", ".join(f"{worker or '全体'} {value / 1e6:.0f}MB" for worker, value in rss.items())
+        return text
+
+
+# 全モジュール共通の集計先
+METRICS = Metrics()
+
+
+# ✅ 実行中は一定間隔で、終了時にもう一度書き出す
+class MetricsReporter:
+    def __init__(self, metrics, prefix, interval=DEFAULT_INTERVAL):
+        self.metrics = metrics
+        self.prefix = prefix
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _write(self):
+        try:
+            # プロセス全体（ブラウザを含む）のメモリも毎回記録する（マシンの大きさを決める材料）
+            self.metrics.gauge("process_rss_bytes", rss_bytes())
+            self.metrics.write(self.prefix)
+        except OSError as e:
+            logging.warning(f"メトリクス書き出しエラー: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._write()
+
+    def start(self):
+        if self.prefix and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name="metrics-reporter", daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.prefix:
+            self._write()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def add_metrics_arguments(parser):
+    parser.add_argument("--metrics", metavar="PREFIX",
+                        help="メトリクスの出力先（PREFIX.json / PREFIX.prom）。省略時は実行マニフェストの隣")
+    parser.add_argument("--metrics-interval", type=float, default=DEFAULT_INTERVAL,
+                        help="実行中にメトリクスを書き出す間隔（秒、0で終了時のみ）")
+
+
+def metrics_prefix(args, manifest=None):
+    if args.metrics:
+        return args.metrics
+    if manifest is not None:
+        return os.path.splitext(manifest.path)[0] + ".metrics"
+    return None
@@ -0,0 +1,52 @@
+import threading
+
+# 1ページで実際に転送したバイト数（ナビゲーション + サブリソース）
+TRANSFER_SIZE_JS = (
+    "return performance.getEntries()"
+    ".filter(e => e.entryType === 'navigation' || e.entryType === 'resource')"
+    ".reduce((sum, e) => sum + (e.transferSize || 0), 0);"
+)
+
+# 検索結果ページに不要なリソース（軽量モードで読み込まない）
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font", "stylesheet", "texttrack", "manifest"}
+BLOCKED_URL_PATTERNS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.css",
+    "*bat.bing.com*", "*c.bing.com/c.gif*", "*clarity.ms*", "*doubleclick.net*",
+    "*googletagmanager.com*", "*th.bing.com/th*",
+]
+TRACKER_HOSTS = ("bat.bing.com", "c.bing.com", "clarity.ms", "doubleclick.net", "googletagmanager.com")
+
+
+# ✅ 1検索あたりの転送量と表示までの時間を集計する
+class LoadStats:
+    def __init__(self, lean=True):
+        self.lean = lean
+        self._lock = threading.Lock()
+        self.pages = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.blocked = 0
+
+    def record(self, transfer_bytes, seconds):
+        with self._lock:
+            self.pages += 1
+            self.bytes += transfer_bytes or 0
+            self.seconds += seconds
+
+    def add_blocked(self, count=1):
+        with self._lock:
+            self.blocked += count
+
+    def summary(self):
+        mode = "軽量" if self.lean else "通常"
+        if not self.pages:
+            return f"ページ読み込み（{mode}モード）: 0件"
+        text = (
+            f"ページ読み込み（{mode}モード）: {self.pages}件, "
+            f"平均 {self.bytes / self.pages / 1024:.1f} KB/件, "
+            f"平均 {self.seconds / self.pages:.2f} 秒/件"
+        )
+        if self.blocked:
+            text += f", 遮断したリクエスト 平均 {self.blocked / self.pages:.1f} 件/件"
+        return text
@@ -0,0 +1,100 @@
+import queue
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# ✅ 検索 → 判定 → 書き込み を待ち行列でつなぐ段（ステージ）
+# 段ごとにスレッド（タスク）数と待ち行列の上限を持つので、
+# 後ろの段が詰まれば前の段が待つ（メモリは一定のまま）。
+
+_STOP = object()
+
+
+class Stage:
+    def __init__(self, name, fn, workers, maxsize):
+        self.name = name
+        self.fn = fn
+        self.queue = queue.Queue(maxsize)
+        self.error = None
+        self._threads = [
+            threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True) for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                return
+            try:
+                self.fn(item)
+            except BaseException as e:
+                # 止まると前の段が詰まるので、最初のエラーを記録して流し続ける
+                if self.error is None:
+                    self.error = e
+
+    def put(self, item):
+        self.queue.put(item)
+
+    # 投入済みの分を処理し終えてからスレッドを止める
+    def close(self):
+        for _ in self._threads:
+            self.queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+
+
+# ✅ asyncio版
+class AsyncStage:
+    def __init__(self, name, fn, workers, maxsize):
+        self.name = name
+        self.fn = fn
+        self.queue = asyncio.Queue(maxsize)
+        self.error = None
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(workers)]
+
+    async def _run(self):
+        while True:
+            item = await self.queue.get()
+            if item is _STOP:
+                return
+            try:
+                await self.fn(item)
+            except Exception as e:
+                if self.error is None:
+                    self.error = e
+
+    async def put(self, item):
+        await self.queue.put(item)
+
+    async def close(self):
+        for _ in self._tasks:
+            await self.queue.put(_STOP)
+        await asyncio.gather(*self._tasks)
+
+
+def raise_stage_errors(stages):
+    for stage in stages:
+        if stage.error is not None:
+            raise stage.error
+
+
+def add_pipeline_arguments(parser):
+    parser.add_argument("--cpu-workers", type=int, default=1, help="検索結果の判定（抽出・スコア計算）を行う並列数")
+    parser.add_argument("--process-pool", action="store_true",
+                        help="判定を別プロセスで行う（GILを避ける。大量処理向け）")
+
+
+# まとめて判定する（プロセスプールがあれば分割して渡す）
+def cpu_map(cpu_pool, fn, *iterables, chunksize=64):
+    if cpu_pool is None:
+        return map(fn, *iterables)
+    return cpu_pool.map(fn, *iterables, chunksize=chunksize)
+
+
+# 判定用のプロセスプール（--process-pool 指定時のみ）
+def open_cpu_pool(args):
+    if args.process_pool:
+        return ProcessPoolExecutor(max_workers=args.cpu_workers)
+    return None
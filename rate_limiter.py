@@ -0,0 +1,66 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+
+
+# ✅ 全ワーカー共通のトークンバケット（AIMDで速度を自動調整）
+# 正常な応答が続けば少しずつ速く（加算）、ブロックや空の結果が出たら半分に（乗算）する。
+class AdaptiveRateLimiter:
+    def __init__(self, rate=1.0, min_rate=0.1, max_rate=3.0, burst=1.0,
+                 increase=0.02, decrease=0.5, jitter=0.2):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease = decrease
+        self.jitter = jitter
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def configure(self, rate=None, max_rate=None, min_rate=None):
+        with self._lock:
+            if max_rate is not None:
+                self.max_rate = max_rate
+            if min_rate is not None:
+                self.min_rate = min_rate
+            if rate is not None:
+                self.rate = rate
+            self.rate = min(self.max_rate, max(self.min_rate, self.rate))
+
+    # トークンを1つ予約し、使えるまでの待ち時間（秒）を返す
+    def _reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        # 全員が同じ間隔で並ばないように少しだけずらす
+        return wait + random.uniform(0, self.jitter / self.rate)
+
+    def acquire(self):
+        time.sleep(self._reserve())
+
+    async def acquire_async(self):
+        await asyncio.sleep(self._reserve())
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_block(self, reason=""):
+        with self._lock:
+            old = self.rate
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            # 貯まっていたトークンも捨てて、すぐに間隔を空ける
+            self._tokens = min(self._tokens, 0.0)
+        logging.warning(f"検索速度を下げます（{reason}）: {old:.2f} → {self.rate:.2f} 件/秒")
+
+
+def add_rate_arguments(parser):
+    parser.add_argument("--rate", type=float, default=1.0, help="開始時の検索速度（件/秒、全ワーカー合計）")
+    parser.add_argument("--max-rate", type=float, default=3.0, help="検索速度の上限（件/秒）")
@@ -0,0 +1,216 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from metrics import METRICS
+from search_backends import SearchBackend, AsyncSearchBackend
+from search_errors import classify_error, TIMEOUT, BLOCK, CRASH, PARSE, OTHER
+
+# ✅ 検索の失敗を分類ごとに再試行し、失敗が続いたら全ワーカーを止める（サーキットブレーカー）
+# 一時的な不調で「処理失敗」の行が大量にでき、もう一度全件を流し直すことを避ける。
+
+
+# 再試行の回数と間隔（指数的に伸ばし、全員が同時に戻らないよう半分はランダム）
+class RetryPolicy:
+    def __init__(self, retries, base, cap):
+        self.retries = retries
+        self.base = base
+        self.cap = cap
+
+    def delay(self, attempt):
+        limit = min(self.cap, self.base * 2 ** attempt)
+        return limit / 2 + random.uniform(0, limit / 2)
+
+
+RETRY_POLICIES = {
+    TIMEOUT: RetryPolicy(3, 2.0, 30.0),
+    # 速度は AdaptiveRateLimiter が下げるので、こちらは長めに待つだけ
+    BLOCK: RetryPolicy(2, 30.0, 300.0),
+    # ドライバー・ページはプールが作り直すので、すぐにやり直してよい
+    CRASH: RetryPolicy(2, 1.0, 10.0),
+    PARSE: RetryPolicy(1, 2.0, 10.0),
+    OTHER: RetryPolicy(1, 2.0, 10.0),
+}
+NO_RETRY = {kind: RetryPolicy(0, 0.0, 0.0) for kind in RETRY_POLICIES}
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+# ✅ 直近 window 回の検索のうち threshold 以上が失敗したら開く（全ワーカーが cooldown 秒待つ）
+# 待ち終わったら1件だけ試し、成功すれば再開、失敗すれば待ち時間を倍にしてまた待つ。
+class CircuitBreaker:
+    def __init__(self, window=50, threshold=0.5, min_calls=20, cooldown=60.0, max_cooldown=600.0):
+        self.threshold = threshold
+        self.min_calls = min(min_calls, window)
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=window)
+        self._open_until = 0.0
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+
+    def configure(self, window=None, threshold=None, cooldown=None):
+        with self._lock:
+            if window is not None:
+                self._outcomes = deque(self._outcomes, maxlen=window)
+                self.min_calls = min(self.min_calls, window)
+            if threshold is not None:
+                self.threshold = threshold
+            if cooldown is not None:
+                self.base_cooldown = self.cooldown = cooldown
+
+    # 検索してよければ 0、待つべきなら待ち時間（秒）を返す
+    def _admit(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return 0.0
+            now = time.monotonic()
+            if now < self._open_until:
+                return self._open_until - now
+            # 試しの1件が戻らないまま時間が過ぎたら、別のワーカーに試させる
+            if self.state == OPEN or now - self._probe_started > self.cooldown:
+                self.state = HALF_OPEN
+                self._probe_started = now
+                return 0.0
+            return min(1.0, self.cooldown)
+
+    def wait(self):
+        while True:
+            delay = self._admit()
+            if not delay:
+                return
+            with METRICS.span("breaker_wait"):
+                time.sleep(delay)
+
+    async def wait_async(self):
+        while True:
+            delay = self._admit()
+            if not delay:
+                return
+            with METRICS.span("breaker_wait"):
+                await asyncio.sleep(delay)
+
+    def record(self, success):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if success:
+                    self.state = CLOSED
+                    self.cooldown = self.base_cooldown
+                    self._outcomes.clear()
+                    logging.warning("検索を再開します（試しの検索が成功）")
+                else:
+                    self._open(min(self.max_cooldown, self.cooldown * 2))
+                return
+            if self.state == OPEN:
+                return
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.threshold:
+                self._open(self.cooldown)
+
+    def _open(self, cooldown):
+        self.state = OPEN
+        self.cooldown = cooldown
+        self._open_until = time.monotonic() + cooldown
+        self._outcomes.clear()
+        METRICS.count("breaker_open")
+        logging.warning(f"失敗が続いたため全ワーカーの検索を {cooldown:.0f}秒止めます")
+
+
+def add_retry_arguments(parser):
+    parser.add_argument("--no-retry", action="store_true", help="検索に失敗しても再試行しない")
+    parser.add_argument("--breaker-window", type=int, default=50, help="失敗率を見る直近の検索回数")
+    parser.add_argument("--breaker-threshold", type=float, default=0.5,
+                        help="この割合以上が失敗したら全ワーカーを止める（1より大きくすると無効）")
+    parser.add_argument("--breaker-cooldown", type=float, default=60.0, help="止める時間（秒、失敗が続けば倍に）")
+
+
+def retry_policies(args):
+    return NO_RETRY if args.no_retry else RETRY_POLICIES
+
+
+# (再試行するか, 待ち時間)
+# budget（ヘッジの QueryBudget）を渡されたら、再試行もその残りから1回ずつ使う
+def _next_attempt(policies, attempts, company, e, budget=None):
+    kind = classify_error(e)
+    METRICS.count(f"error_{kind}")
+    n = attempts.get(kind, 0)
+    policy = policies[kind]
+    if n >= policy.retries:
+        return False, 0.0
+    if budget is not None and not budget.take():
+        METRICS.count("retry_over_budget")
+        return False, 0.0
+    attempts[kind] = n + 1
+    delay = policy.delay(n)
+    METRICS.count("retry")
+    logging.warning(f"再試行 {n + 1}/{policy.retries}（{kind}）: {company} - {e}（{delay:.1f}秒後）")
+    return True, delay
+
+
+# ✅ 再試行とサーキットブレーカーをかけたバックエンド
+class ResilientBackend(SearchBackend):
+    def __init__(self, backend, breaker, policies=RETRY_POLICIES):
+        self.backend = backend
+        self.name = backend.name
+        self.size = backend.size
+        self.breaker = breaker
+        self.policies = policies
+
+    def search(self, company, query=None, budget=None):
+        attempts = {}
+        while True:
+            self.breaker.wait()
+            try:
+                results = self.backend.search(company, query)
+            except Exception as e:
+                self.breaker.record(False)
+                retry, delay = _next_attempt(self.policies, attempts, company, e, budget)
+                if not retry:
+                    raise
+                with METRICS.span("backoff"):
+                    time.sleep(delay)
+                continue
+            self.breaker.record(True)
+            return results
+
+    def close(self):
+        self.backend.close()
+
+
+class AsyncResilientBackend(AsyncSearchBackend):
+    def __init__(self, backend, breaker, policies=RETRY_POLICIES):
+        self.backend = backend
+        self.name = backend.name
+        self.size = backend.size
+        self.breaker = breaker
+        self.policies = policies
+
+    async def start(self):
+        await self.backend.start()
+
+    async def search(self, company, query=None, budget=None):
+        attempts = {}
+        while True:
+            await self.breaker.wait_async()
+            try:
+                results = await self.backend.search(company, query)
+            except Exception as e:
+                self.breaker.record(False)
+                retry, delay = _next_attempt(self.policies, attempts, company, e, budget)
+                if not retry:
+                    raise
+                with METRICS.span("backoff"):
+                    await asyncio.sleep(delay)
+                continue
+            self.breaker.record(True)
+            return results
+
+    async def close(self):
+        await self.backend.close()
@@ -0,0 +1,261 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from csv_stream import iter_companies
+from sharding import shard_rows, parse_shard, format_shard
+
+PENDING = "pending"
+IN_FLIGHT = "in-flight"
+DONE = "done"
+FAILED = "failed"
+
+
+def add_resume_arguments(parser):
+    parser.add_argument("--run-dir", default="runs", help="実行マニフェストの保存先")
+    parser.add_argument("--resume", metavar="RUN", help="中断した実行（IDまたはマニフェストのパス）を再開する")
+
+
+# ✅ 実行マニフェスト（入力の各行の状態を記録する）
+class RunManifest:
+    def __init__(self, path):
+        self.path = path
+        self.run_id = os.path.splitext(os.path.basename(path))[0]
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # 書き込みは入力の読み込み・結果の書き込みスレッド・ハートビートから同時に来る
+        self._lock = threading.Lock()
+        with self._conn as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rows ("
+                " row_no INTEGER PRIMARY KEY,"
+                " company TEXT NOT NULL,"
+                " state TEXT NOT NULL,"
+                " result TEXT,"
+                " updated_at REAL NOT NULL,"
+                # 作業キューとして使うときの貸し出し先・期限・貸し出し回数
+                " worker TEXT,"
+                " lease_until REAL,"
+                " attempts INTEGER NOT NULL DEFAULT 0)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS rows_state ON rows (state)")
+
+    @classmethod
+    def create(cls, run_dir, input_path, output_path, shard=None):
+        os.makedirs(run_dir, exist_ok=True)
+        run_id = time.strftime("%Y%m%d-%H%M%S")
+        if shard is not None:
+            # 同時に起動した分担同士でIDがぶつからないようにする
+            run_id += f"-shard{shard[0]}of{shard[1]}"
+        path = os.path.join(run_dir, f"{run_id}.sqlite3")
+        suffix = 1
+        while os.path.exists(path):
+            suffix += 1
+            path = os.path.join(run_dir, f"{run_id}-{suffix}.sqlite3")
+        manifest = cls(path)
+        manifest._set_meta(input=os.path.abspath(input_path), output=os.path.abspath(output_path), input_complete="0",
+                           shard=format_shard(shard) if shard is not None else "")
+        return manifest
+
+    @classmethod
+    def open(cls, run_dir, run):
+        path = run if os.path.exists(run) else os.path.join(run_dir, f"{run}.sqlite3")
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"マニフェストが見つかりません: {run}")
+        return cls(path)
+
+    def _set_meta(self, **values):
+        with self._lock, self._conn as conn:
+            conn.executemany("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", values.items())
+
+    def _meta(self, name):
+        row = self._conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    @property
+    def input_path(self):
+        return self._meta("input")
+
+    @property
+    def output_path(self):
+        return self._meta("output")
+
+    @property
+    def shard(self):
+        value = self._meta("shard")
+        return parse_shard(value) if value else None
+
+    # 入力CSVのうち、この実行が受け持つ行
+    def source_rows(self, chunksize=1000):
+        return shard_rows(iter_companies(self.input_path, chunksize), self.shard)
+
+    @property
+    def input_complete(self):
+        return self._meta("input_complete") == "1"
+
+    # --queue で作った実行（別プロセスが --attach で加われる）
+    @property
+    def is_queue(self):
+        return self._meta("queue") == "1"
+
+    # ✅ 入力を読みながら登録する（チャンク単位で pending を書き、渡す直前に in-flight にする）
+    def track(self, rows, batch_size=1000):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield from self._register(batch)
+                batch = []
+        yield from self._register(batch)
+        self._set_meta(input_complete="1")
+
+    def _insert(self, batch):
+        now = time.time()
+        with self._lock, self._conn as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO rows (row_no, company, state, updated_at) VALUES (?, ?, ?, ?)",
+                [(row_no, company, PENDING, now) for row_no, company in batch],
+            )
+
+    def _register(self, batch):
+        self._insert(batch)
+        for row_no, company in batch:
+            self.start(row_no)
+            yield row_no, company
+
+    def _last_row(self):
+        last = self._conn.execute("SELECT MAX(row_no) FROM rows").fetchone()[0]
+        return -1 if last is None else last
+
+    def start(self, row_no):
+        with self._lock, self._conn as conn:
+            conn.execute("UPDATE rows SET state = ?, updated_at = ? WHERE row_no = ?", (IN_FLIGHT, time.time(), row_no))
+
+    def finish(self, row_no, result):
+        state = FAILED if result[4] == "処理失敗" else DONE
+        with self._lock, self._conn as conn:
+            conn.execute(
+                "UPDATE rows SET state = ?, result = ?, lease_until = NULL, updated_at = ? WHERE row_no = ?",
+                (state, json.dumps(result, ensure_ascii=False), time.time(), row_no),
+            )
+
+    # 貸し出し期限（秒）はキューごとに1つ（--attach したワーカーも同じ値を使う）
+    @property
+    def lease_seconds(self):
+        value = self._meta("lease_seconds")
+        return float(value) if value else None
+
+    # ✅ 作業キュー: 入力の残りをすべて pending で登録する（処理はしない）
+    def enqueue(self, lease_seconds, chunksize=1000, batch_size=1000):
+        self._set_meta(queue="1", lease_seconds=str(lease_seconds))
+        if self.input_complete:
+            return
+        last = self._last_row()
+        batch = []
+        for row in self.source_rows(chunksize):
+            if row[0] <= last:
+                continue
+            batch.append(row)
+            if len(batch) >= batch_size:
+                self._insert(batch)
+                batch = []
+        self._insert(batch)
+        self._set_meta(input_complete="1")
+
+    # 失敗した行をもう一度貸し出せるようにする（--resume と同じく失敗行はやり直す）
+    def requeue_failed(self):
+        with self._lock, self._conn as conn:
+            return conn.execute(
+                "UPDATE rows SET state = ?, attempts = 0, updated_at = ? WHERE state = ?", (PENDING, time.time(), FAILED)
+            ).rowcount
+
+    # ✅ 最大 n 行を worker に貸し出す（pending の行と、期限が切れた in-flight の行）
+    # 1つのUPDATE文で選んで書き換えるので、複数プロセスが同時に呼んでも同じ行は渡らない。
+    # max_attempts 回貸し出しても終わらなかった行（処理中にプロセスが落ち続ける行）は失敗にする。
+    def lease(self, worker, n, lease_seconds, max_attempts=3):
+        now = time.time()
+        expired = "(state = ? OR (state = ? AND (lease_until IS NULL OR lease_until < ?)))"
+        with self._lock, self._conn as conn:
+            conn.execute(
+                "UPDATE rows SET state = ?, lease_until = NULL, updated_at = ?,"
+                " result = json_array(company, 'エラー', '不明', '不明', '処理失敗', ?, '')"
+                f" WHERE {expired} AND attempts >= ?",
+                (FAILED, now, f"{max_attempts}回貸し出しても完了しませんでした", PENDING, IN_FLIGHT, now, max_attempts),
+            )
+            rows = conn.execute(
+                "UPDATE rows SET state = ?, worker = ?, lease_until = ?, attempts = attempts + 1, updated_at = ?"
+                f" WHERE row_no IN (SELECT row_no FROM rows WHERE {expired} ORDER BY row_no LIMIT ?)"
+                " RETURNING row_no, company",
+                (IN_FLIGHT, worker, now + lease_seconds, now, PENDING, IN_FLIGHT, now, n),
+            ).fetchall()
+        return sorted(rows)
+
+    # 貸し出し中の行の期限を延ばす
+    def heartbeat(self, worker, lease_seconds):
+        now = time.time()
+        with self._lock, self._conn as conn:
+            return conn.execute(
+                "UPDATE rows SET lease_until = ? WHERE state = ? AND worker = ?", (now + lease_seconds, IN_FLIGHT, worker)
+            ).rowcount
+
+    # 終わらなかった行を返す（正常に抜けるとき。すぐ他のワーカーが引き取れる）
+    def release(self, worker):
+        with self._lock, self._conn as conn:
+            return conn.execute(
+                "UPDATE rows SET state = ?, lease_until = NULL, attempts = MAX(attempts - 1, 0), updated_at = ?"
+                " WHERE state = ? AND worker = ?", (PENDING, time.time(), IN_FLIGHT, worker)
+            ).rowcount
+
+    def unfinished(self):
+        return self._conn.execute("SELECT COUNT(*) FROM rows WHERE state IN (?, ?)", (PENDING, IN_FLIGHT)).fetchone()[0]
+
+    # ✅ 再開: 終わっていない行だけを返し、入力の読み込みが途中だったら続きから読む
+    def resume_rows(self, chunksize=1000):
+        unfinished = self._conn.execute(
+            "SELECT row_no, company FROM rows WHERE state != ? ORDER BY row_no", (DONE,)
+        ).fetchall()
+        for row_no, company in unfinished:
+            self.start(row_no)
+            yield row_no, company
+        if not self.input_complete:
+            last = self._last_row()
+            rest = ((row_no, company) for row_no, company in self.source_rows(chunksize) if row_no > last)
+            yield from self.track(rest)
+
+    def done_results(self):
+        for row_no, result in self._conn.execute(
+            "SELECT row_no, result FROM rows WHERE state = ? ORDER BY row_no", (DONE,)
+        ):
+            yield row_no, json.loads(result)
+
+    # 他のワーカーが書いた結果（完了・失敗とも）
+    def results_from_others(self, worker):
+        for row_no, result in self._conn.execute(
+            "SELECT row_no, result FROM rows WHERE state IN (?, ?) AND worker IS NOT ? ORDER BY row_no",
+            (DONE, FAILED, worker),
+        ):
+            yield row_no, json.loads(result)
+
+    def counts(self):
+        return dict(self._conn.execute("SELECT state, COUNT(*) FROM rows GROUP BY state").fetchall())
+
+    def close(self):
+        self._conn.close()
+
+
+# ✅ 新規実行ならマニフェストを作り、--resume なら既存のものを開く
+def open_run(args, chunksize=1000):
+    shard = getattr(args, "shard", None)
+    if args.resume:
+        manifest = RunManifest.open(args.run_dir, args.resume)
+        if manifest.shard != shard:
+            # 分担ごとにキャッシュが別なので、作成時と同じ --shard が必要
+            recorded = format_shard(manifest.shard) if manifest.shard else "なし"
+            manifest.close()
+            raise ValueError(f"--shard が作成時と違います（作成時: {recorded}）")
+        return manifest, manifest.resume_rows(chunksize)
+    manifest = RunManifest.create(args.run_dir, args.input, args.output, shard)
+    return manifest, manifest.track(manifest.source_rows(chunksize))
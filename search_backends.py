@@ -0,0 +1,374 @@
+import time
+import asyncio
+import logging
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from metrics import METRICS
+from search_errors import BlockPageError, SerpParseError, is_block_page, is_no_results_page
+
+DEFAULT_BING_URL = "https://www.bing.com/search"
+BACKEND_CHOICES = ["browser", "http"]
+HEDGE_CHOICES = ["off", "delay", "parallel"]
+DEFAULT_HEDGE_DELAY = 3.0
+DEFAULT_QUERY_BUDGET = 3
+
+
+def build_query(company):
+    return f"{company} 社名変更 OR 商号変更 OR 新社名"
+
+
+# 通常の検索で見つからないときの言い換え（優先順）
+def build_hedge_queries(company):
+    name = company.strip()
+    return [f'"{name}" 新商号', f"{name} 旧社名"]
+
+
+def build_search_url(query, base_url=DEFAULT_BING_URL):
+    return f"{base_url}?q={urllib.parse.quote(query)}"
+
+
+def add_backend_arguments(parser):
+    parser.add_argument("--backend", choices=BACKEND_CHOICES, default="browser",
+                        help="検索方法（browser: ブラウザ / http: HTTPで直接取得）")
+    parser.add_argument("--bing-url", default=DEFAULT_BING_URL, help="検索URL（ローカルの代替サーバーで試すとき用）")
+    parser.add_argument("--hedge", choices=HEDGE_CHOICES, default="off",
+                        help="言い換えクエリも投げる（delay: 遅いか見つからないとき / parallel: 最初から同時に）")
+    parser.add_argument("--hedge-delay", type=float, default=DEFAULT_HEDGE_DELAY,
+                        help="delay のとき、言い換えを投げるまでの待ち時間（秒）")
+    parser.add_argument("--query-budget", type=int, default=DEFAULT_QUERY_BUDGET,
+                        help="1社あたりの検索回数の上限（言い換えと再試行を含む）")
+
+
+# ✅ 検索結果のリスト（どのクエリで得た結果かを持つ）
+class SearchResults(list):
+    def __init__(self, results=(), query=None):
+        super().__init__(results)
+        self.query = query
+
+
+# ✅ 検索バックエンドの共通インターフェース
+# search() は (タイトル+スニペット, スニペット, URL) のリスト（SearchResults）を返す。
+class SearchBackend:
+    name = "base"
+    size = 1  # 同時に処理できる件数
+
+    def search(self, company, query=None):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncSearchBackend:
+    name = "base"
+    size = 1
+
+    async def start(self):
+        pass
+
+    async def search(self, company, query=None):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+# ✅ 同期バックエンドをasyncioから使う（スレッドで実行）
+class ThreadedAsyncBackend(AsyncSearchBackend):
+    def __init__(self, backend):
+        self.backend = backend
+        self.name = backend.name
+        self.size = backend.size
+        self._slots = asyncio.Semaphore(backend.size)
+
+    async def search(self, company, query=None):
+        await self._slots.acquire()
+        future = asyncio.get_running_loop().run_in_executor(None, self.backend.search, company, query)
+        future.add_done_callback(self._done)
+        # 取り消されてもスレッドの検索は止まらないので、枠はスレッドが終わるまで返さない
+        return await asyncio.shield(future)
+
+    def _done(self, future):
+        self._slots.release()
+        if not future.cancelled():
+            future.exception()  # 取り消した後に失敗しても「never retrieved」を出さない
+
+    async def close(self):
+        self.backend.close()
+
+
+# ✅ 1社あたりの検索回数の残り（言い換えと再試行で分け合う）
+class QueryBudget:
+    def __init__(self, total):
+        self.left = total
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            if self.left <= 0:
+                return False
+            self.left -= 1
+            return True
+
+
+# ✅ 言い換えクエリで待ち時間の長い会社を減らす（ヘッジ）
+# 通常のクエリの結果が hedge_delay 秒たっても返らないか、返っても社名変更が
+# 見つからなければ、言い換えを投げる（parallel なら最初から全部投げる）。
+# confident(company, results) が真になった結果を採用し、残りは取り消す。
+# どれも見つからなければ通常のクエリ（優先順で最初に返ったもの）の結果を返す。
+# backend は再試行をかけたもの（ResilientBackend）で、再試行も budget 回のうちに数える。
+class HedgedBackend(SearchBackend):
+    def __init__(self, backend, confident, mode="delay", delay=DEFAULT_HEDGE_DELAY, budget=DEFAULT_QUERY_BUDGET):
+        self.backend = backend
+        self.name = backend.name
+        self.size = backend.size
+        self.confident = confident
+        self.mode = mode
+        self.delay = delay
+        self.budget = max(1, budget)
+        self._executor = ThreadPoolExecutor(max_workers=backend.size * self.budget, thread_name_prefix="hedge")
+        # 言い換えを含めても同時に走る検索はバックエンドの枠数まで
+        self._slots = threading.BoundedSemaphore(backend.size)
+
+    def _search(self, company, query, budget):
+        with self._slots:
+            return self.backend.search(company, query, budget=budget)
+
+    def search(self, company, query=None):
+        queries = ([query or build_query(company)] + build_hedge_queries(company))[:self.budget]
+        pending = {}
+        results_by_index = {}
+        error = None
+        launched = 0
+        budget = QueryBudget(self.budget)
+
+        def can_launch():
+            return launched < len(queries) and budget.left > 0
+
+        def launch():
+            nonlocal launched
+            if not budget.take():
+                return
+            if launched:
+                METRICS.count("hedge_query")
+            pending[self._executor.submit(self._search, company, queries[launched], budget)] = launched
+            launched += 1
+
+        launch()
+        if self.mode == "parallel":
+            while can_launch():
+                launch()
+
+        while pending:
+            done, _ = wait(pending, timeout=self.delay if can_launch() else None, return_when=FIRST_COMPLETED)
+            if not done:
+                # 返りが遅い → 言い換えを追加で投げる
+                launch()
+                continue
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    results = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                if self.confident(company, results):
+                    # 始まっていない検索は取り消す（実行中のものは結果を捨てる）
+                    for other in pending:
+                        if other.cancel():
+                            METRICS.count("hedge_cancelled")
+                    if index:
+                        METRICS.count("hedge_win")
+                    return results
+                results_by_index[index] = results
+            # 返ったが見つからなかった → 次の言い換えをすぐに投げる
+            if not pending and can_launch():
+                launch()
+
+        if results_by_index:
+            return results_by_index[min(results_by_index)]
+        raise error
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+        self.backend.close()
+
+
+# ✅ asyncio版（残りの検索は実際に取り消す）
+class AsyncHedgedBackend(AsyncSearchBackend):
+    def __init__(self, backend, confident, mode="delay", delay=DEFAULT_HEDGE_DELAY, budget=DEFAULT_QUERY_BUDGET):
+        self.backend = backend
+        self.name = backend.name
+        self.size = backend.size
+        self.confident = confident
+        self.mode = mode
+        self.delay = delay
+        self.budget = max(1, budget)
+
+    async def start(self):
+        await self.backend.start()
+
+    async def search(self, company, query=None):
+        queries = ([query or build_query(company)] + build_hedge_queries(company))[:self.budget]
+        pending = {}
+        results_by_index = {}
+        error = None
+        launched = 0
+        budget = QueryBudget(self.budget)
+
+        def can_launch():
+            return launched < len(queries) and budget.left > 0
+
+        def launch():
+            nonlocal launched
+            if not budget.take():
+                return
+            if launched:
+                METRICS.count("hedge_query")
+            pending[asyncio.ensure_future(self.backend.search(company, queries[launched], budget=budget))] = launched
+            launched += 1
+
+        launch()
+        if self.mode == "parallel":
+            while can_launch():
+                launch()
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, timeout=self.delay if can_launch() else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    launch()
+                    continue
+                for task in done:
+                    index = pending.pop(task)
+                    try:
+                        results = task.result()
+                    except Exception as e:
+                        error = error or e
+                        continue
+                    if self.confident(company, results):
+                        if index:
+                            METRICS.count("hedge_win")
+                        return results
+                    results_by_index[index] = results
+                if not pending and can_launch():
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+                METRICS.count("hedge_cancelled")
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        if results_by_index:
+            return results_by_index[min(results_by_index)]
+        raise error
+
+    async def close(self):
+        await self.backend.close()
+
+
+# ✅ ブラウザを使わないHTTPバックエンド（keep-aliveの接続を使い回す）
+class HttpBackend(SearchBackend):
+    name = "http"
+
+    def __init__(self, size, limiter, base_url=DEFAULT_BING_URL, timeout=15.0, stats=None):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.size = size
+        self.limiter = limiter
+        self.base_url = base_url
+        self.timeout = timeout
+        self.stats = stats
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "User-Agent": (
+                "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+                "(KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+            ),
+            "Accept-Language": "ja,en;q=0.8",
+        })
+
+    def search(self, company, query=None):
+        query = query or build_query(company)
+        url = build_search_url(query, self.base_url)
+        with METRICS.span("rate_wait"):
+            self.limiter.acquire()
+        started = time.perf_counter()
+        with METRICS.span("navigate"):
+            response = self.session.get(url, timeout=self.timeout)
+        if self.stats is not None:
+            self.stats.record(len(response.content), time.perf_counter() - started)
+        html = response.text
+        if response.status_code == 429 or is_block_page(html) and "b_algo" not in html:
+            METRICS.count("block_page")
+            self.limiter.on_block("ブロックページ")
+            raise BlockPageError(f"ブロックページを検出: {company}")
+        response.raise_for_status()
+
+        with METRICS.span("scrape"):
+            results = parse_serp(html)
+        if not results and not is_no_results_page(html):
+            # 検索結果も「結果なし」も無いページ。「変更なし」として記録せず、再試行に回す
+            METRICS.count("empty_results")
+            self.limiter.on_block("検索結果が空")
+            raise SerpParseError(f"検索結果も「結果なし」の表示もありません: {company}")
+        self.limiter.on_success()
+        return SearchResults(results, query)
+
+    def close(self):
+        self.session.close()
+
+
+# ✅ 検索結果HTMLの解析（li.b_algo / h2 / .b_caption）
+def _has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+_ALGO_XPATH = f"//li[{_has_class('b_algo')}]"
+_CAPTION_XPATH = f".//*[{_has_class('b_caption')}]"
+
+
+def _text(elem):
+    return " ".join(elem.text_content().split())
+
+
+def parse_serp(html, limit=10):
+    import lxml.html
+
+    if not html:
+        return []
+    tree = lxml.html.fromstring(html)
+    results = []
+    elements = tree.xpath(_ALGO_XPATH)[:limit]
+    for elem in elements:
+        try:
+            title = elem.xpath(".//h2")[0]
+            snippet = elem.xpath(_CAPTION_XPATH)[0]
+            link = elem.xpath(".//a[@href]")[0]
+        except IndexError as e:
+            logging.debug(f"検索結果解析エラー: {e}")
+            continue
+        snippet_text = _text(snippet)
+        results.append((_text(title) + "\n" + snippet_text, snippet_text, link.get("href")))
+    if elements and not results:
+        raise SerpParseError("検索結果を読み取れません")
+    return results
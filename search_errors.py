@@ -0,0 +1,74 @@
+# ✅ 検索まわりの例外とSERPの判定
+
+
+class SearchError(Exception):
+    pass
+
+
+# Bingにブロックされた（キャプチャ・異常トラフィック警告など）
+class BlockPageError(SearchError):
+    pass
+
+
+BLOCK_MARKERS = (
+    "b_captcha", "captcha", "/challenge/",
+    "unusual traffic", "異常なトラフィック",
+)
+NO_RESULTS_MARKERS = ("b_no",)
+
+
+# 検索結果・結果なし・ブロックのどれかが表示されたら読み込み完了とみなす
+READY_SELECTOR = "li.b_algo, .b_no, #b_captcha, iframe[src*='captcha'], #challenge-form"
+DEFAULT_READY_TIMEOUT = 10.0
+
+
+def is_block_page(html):
+    html = (html or "").lower()
+    return any(marker in html for marker in BLOCK_MARKERS)
+
+
+def is_no_results_page(html):
+    return any(marker in (html or "") for marker in NO_RESULTS_MARKERS)
+
+
+# 検索結果は表示されたが、1件も読み取れなかった（ページの構造が変わったなど）
+class SerpParseError(SearchError):
+    pass
+
+
+# 待っても検索結果・結果なし・ブロックのどれも表示されなかった
+class SerpTimeoutError(SearchError):
+    pass
+
+
+# ✅ 失敗の分類（分類ごとに再試行の回数・間隔を変える）
+TIMEOUT = "timeout"      # 読み込み・表示待ちのタイムアウト
+BLOCK = "block"          # ブロックページ
+CRASH = "crash"          # ブラウザ・ドライバーが落ちた、接続できない
+PARSE = "parse"          # 検索結果の解析失敗
+OTHER = "other"
+ERROR_KINDS = (TIMEOUT, BLOCK, CRASH, PARSE, OTHER)
+
+# Selenium / Playwright / requests を読み込まずに判定するため、例外の文言で見分ける
+CRASH_MARKERS = (
+    "invalid session id", "session deleted", "chrome not reachable", "no such window",
+    "disconnected", "target closed", "has been closed", "connection refused", "connection aborted",
+)
+
+
+def classify_error(e):
+    if isinstance(e, BlockPageError):
+        return BLOCK
+    if isinstance(e, SerpParseError):
+        return PARSE
+    if isinstance(e, SerpTimeoutError):
+        return TIMEOUT
+    names = [cls.__name__ for cls in type(e).__mro__]
+    message = str(e).lower()
+    if any(marker in message for marker in CRASH_MARKERS):
+        return CRASH
+    if isinstance(e, TimeoutError) or any("Timeout" in name for name in names):
+        return TIMEOUT
+    if isinstance(e, ConnectionError) or "ConnectionError" in names:
+        return CRASH
+    return OTHER
@@ -0,0 +1,137 @@
+import os
+import sys
+import hashlib
+import argparse
+import subprocess
+from csv_stream import write_sorted_output
+
+# ✅ 複数台での分担実行（--shard i/N）
+# 正規化した会社名のハッシュで行を N 個に分ける。同じ入力なら何度実行しても同じ分け方になり、
+# 重複する会社名は必ず同じ分担に入る。キャッシュ・スナップショットは分担ごとに別ファイル。
+#   python check_company_name.py input.csv out.shard-0-of-4.csv --shard 0/4   （各マシンで i を変えて実行）
+#   python sharding.py merge output.csv out.shard-*.csv --shards 4 --cache-db bing_cache_v6_final_full.sqlite3
+#   python sharding.py run-local --shards 4 input.csv output.csv   （1台でN個のプロセスとして試す）
+
+
+# 各エンジンの normalize_company と同じ
+def normalize_company(name):
+    return name.replace("株式会社", "").replace(" ", "").replace("　", "").lower()
+
+
+def parse_shard(text):
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"i/N の形式で指定してください: {text}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"i は 0 から N-1 までです: {text}")
+    return index, count
+
+
+def format_shard(shard):
+    return f"{shard[0]}/{shard[1]}"
+
+
+def shard_of(company, count):
+    digest = hashlib.sha1(normalize_company(company).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+def shard_rows(rows, shard):
+    if shard is None:
+        yield from rows
+        return
+    index, count = shard
+    for row_no, company in rows:
+        if shard_of(company, count) == index:
+            yield row_no, company
+
+
+# 分担ごとのファイル名（cache.sqlite3 → cache.shard-0-of-4.sqlite3）
+def shard_path(path, shard):
+    if shard is None:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard-{shard[0]}-of-{shard[1]}{ext}"
+
+
+def add_shard_arguments(parser):
+    parser.add_argument("--shard", type=parse_shard, metavar="i/N",
+                        help="入力を N 個に分けた i 番目（0 始まり）だけを処理する。出力には行番号を残す")
+
+
+# ✅ 分担ごとの出力（行番号つき）を入力順の1ファイルにまとめる
+# finalize_output と同じ外部ソートで書くので、1台で実行したときの出力とバイト単位で同じになる
+def merge_outputs(output_path, shard_outputs):
+    return write_sorted_output(shard_outputs, output_path)
+
+
+# ✅ 分担ごとのキャッシュ・スナップショットを1つにまとめる（同じキーは取得日時が新しい方）
+def merge_segments(db_path, count, store_class):
+    target = store_class(db_path)
+    try:
+        for index in range(count):
+            segment = shard_path(db_path, (index, count))
+            if not os.path.exists(segment):
+                print(f"見つかりません（スキップ）: {segment}")
+                continue
+            print(f"{segment}: {target.merge_from(segment)}件")
+        print(f"合計: {len(target)}件 → {db_path}")
+    finally:
+        target.close()
+
+
+def run_local(args, extra):
+    processes = []
+    outputs = []
+    for index in range(args.shards):
+        shard = (index, args.shards)
+        output = shard_path(args.output, shard)
+        outputs.append(output)
+        command = [sys.executable, args.engine, args.input, output, "--shard", format_shard(shard)] + extra
+        print(" ".join(command))
+        processes.append(subprocess.Popen(command))
+    failed = [i for i, p in enumerate(processes) if p.wait() != 0]
+    if failed:
+        sys.exit(f"失敗した分担: {failed}")
+    print(f"✅ 統合: {args.output}（{merge_outputs(args.output, outputs)}社）")
+
+
+def main():
+    from cache_store import CacheStore
+    from snapshot_store import SnapshotStore
+
+    parser = argparse.ArgumentParser(description="分担実行の出力・キャッシュをまとめる")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    merge = sub.add_parser("merge", help="分担ごとの出力とキャッシュをまとめる")
+    merge.add_argument("output", help="まとめた出力CSV（入力順）")
+    merge.add_argument("shard_outputs", nargs="*", help="各分担の出力CSV（--shard で作ったもの）")
+    merge.add_argument("--shards", type=int, help="分担数 N（キャッシュ・スナップショットをまとめるとき）")
+    merge.add_argument("--cache-db", help="まとめ先のキャッシュ（分担ごとのファイルはこの名前に .shard-i-of-N がつく）")
+    merge.add_argument("--snapshot-db", help="まとめ先のスナップショット")
+
+    local = sub.add_parser("run-local", help="1台で N 個のプロセスとして分担実行し、出力をまとめる")
+    local.add_argument("input")
+    local.add_argument("output")
+    local.add_argument("--shards", type=int, default=2)
+    local.add_argument("--engine", default="check_company_name.py", help="実行するスクリプト")
+
+    args, extra = parser.parse_known_args()
+    if args.command == "run-local":
+        return run_local(args, extra)
+    if extra:
+        parser.error(f"不明な引数: {' '.join(extra)}")
+
+    if args.shard_outputs:
+        print(f"✅ 統合: {args.output}（{merge_outputs(args.output, args.shard_outputs)}社）")
+    if (args.cache_db or args.snapshot_db) and not args.shards:
+        parser.error("--cache-db / --snapshot-db には --shards が必要です")
+    if args.cache_db:
+        merge_segments(args.cache_db, args.shards, CacheStore)
+    if args.snapshot_db:
+        merge_segments(args.snapshot_db, args.shards, SnapshotStore)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+import json
+import time
+import zlib
+import sqlite3
+import inspect
+import hashlib
+import argparse
+import itertools
+import threading
+from pipeline import cpu_map
+
+# ✅ 検索結果の生データ（10件すべての タイトル+スニペット / スニペット / URL と、検索クエリ）
+# 同じ内容は1回だけ保存する（内容のハッシュがキー）。zlibで圧縮する。
+# extract_info や BAD_NAMES、DOMAIN_PRIORITY を変えたときに、Bingに触れずに判定し直すためのもの。
+
+
+# ✅ 判定ルールの指紋（一覧・正規表現・判定関数とクラスのソースから作る）
+# どれか1つでも変われば別の値になる。キャッシュの各行に記録する。
+def rule_fingerprint(values, functions):
+    digest = hashlib.sha256(json.dumps(values, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    for fn in functions:
+        try:
+            source = inspect.getsource(fn)
+        except (OSError, TypeError):
+            source = fn.__code__.co_code.hex()
+        digest.update(source.encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def encode_results(results):
+    data = json.dumps([list(r) for r in results], ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(data).hexdigest(), zlib.compress(data, 6)
+
+
+def decode_results(blob):
+    return [tuple(r) for r in json.loads(zlib.decompress(blob))]
+
+
+class SnapshotStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._conns = []
+        self._lock = threading.Lock()
+        with self._conn() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, data BLOB NOT NULL)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS snapshots ("
+                " key TEXT PRIMARY KEY,"
+                " company TEXT NOT NULL,"
+                " query TEXT,"
+                " digest TEXT NOT NULL,"
+                " fetched_at REAL NOT NULL)"
+            )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    # 会社ごとに最新の1件を残す
+    def put(self, key, company, query, results, fetched_at=None):
+        digest, blob = encode_results(results)
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        with self._conn() as conn:
+            conn.execute("INSERT OR IGNORE INTO blobs (digest, data) VALUES (?, ?)", (digest, blob))
+            conn.execute(
+                "INSERT INTO snapshots (key, company, query, digest, fetched_at) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET company = excluded.company, query = excluded.query,"
+                " digest = excluded.digest, fetched_at = excluded.fetched_at",
+                (key, company, query, digest, fetched_at),
+            )
+        return digest
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT s.company, s.query, b.data, s.fetched_at FROM snapshots s JOIN blobs b ON b.digest = s.digest"
+            " WHERE s.key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], decode_results(row[2]), row[3]
+
+    # (キー, 会社名, クエリ, 検索結果, 取得日時) を batch_size 件ずつ読み出す
+    def iter_all(self, batch_size=1000):
+        last = ""
+        while True:
+            rows = self._conn().execute(
+                "SELECT s.key, s.company, s.query, b.data, s.fetched_at"
+                " FROM snapshots s JOIN blobs b ON b.digest = s.digest"
+                " WHERE s.key > ? ORDER BY s.key LIMIT ?", (last, batch_size)
+            ).fetchall()
+            if not rows:
+                return
+            for key, company, query, blob, fetched_at in rows:
+                yield key, company, query, decode_results(blob), fetched_at
+            last = rows[-1][0]
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM snapshots").fetchone()[0]
+
+    def stats(self):
+        conn = self._conn()
+        snapshots = conn.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0]
+        blobs, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM blobs").fetchone()
+        return {"snapshots": snapshots, "blobs": blobs, "compressed_bytes": size}
+
+    # ✅ 別のスナップショットファイルを取り込む。同じキーは取得日時が新しい方を残す
+    def merge_from(self, path):
+        conn = self._conn()
+        conn.execute("ATTACH DATABASE ? AS src", (path,))
+        try:
+            with conn:
+                conn.execute("INSERT OR IGNORE INTO blobs (digest, data) SELECT digest, data FROM src.blobs")
+                return conn.execute(
+                    "INSERT INTO snapshots (key, company, query, digest, fetched_at)"
+                    " SELECT key, company, query, digest, fetched_at FROM src.snapshots WHERE true"
+                    " ON CONFLICT(key) DO UPDATE SET company = excluded.company, query = excluded.query,"
+                    " digest = excluded.digest, fetched_at = excluded.fetched_at"
+                    " WHERE excluded.fetched_at > snapshots.fetched_at"
+                ).rowcount
+        finally:
+            conn.execute("DETACH DATABASE src")
+
+    # どの会社からも参照されなくなった生データを消す
+    def prune(self):
+        with self._conn() as conn:
+            return conn.execute("DELETE FROM blobs WHERE digest NOT IN (SELECT digest FROM snapshots)").rowcount
+
+    def close(self):
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            conn.close()
+        self._local = threading.local()
+
+
+# ✅ 保存済みの検索結果だけで判定し直し、キャッシュを更新する（ブラウザ不要）
+# decide(company, results) は各エンジンの判定関数。取得日時は元のまま（有効期限は延びない）。
+# (判定し直した件数, 結果が変わった件数) を返す。
+def reprocess(snapshots, store, decide, cpu_pool=None, batch_size=1000, progress=None):
+    total = changed = 0
+    rows = snapshots.iter_all(batch_size)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return total, changed
+        results = cpu_map(cpu_pool, decide, [b[1] for b in batch], [b[3] for b in batch])
+        items = []
+        for (key, _, _, _, fetched_at), result in zip(batch, results):
+            old = store.get(key, include_expired=True)
+            if old is None or old[1:5] != result[1:5]:
+                changed += 1
+            items.append((key, result, fetched_at))
+        store.put_many(items)
+        total += len(batch)
+        if progress is not None:
+            progress.update(len(batch))
+
+
+# キャッシュの行に残っている候補（採用したスニペットとURLの1件だけ。タイトルは残っていない）
+def stored_candidates(result):
+    snippet, url = result[5], result[6]
+    if not snippet or snippet == "なし":
+        return []
+    return [(snippet, snippet, url)]
+
+
+# 結果が変わる行の1行表示（--dry-run 用）
+def describe_change(key, old, new):
+    return f"{key}: {old[4]} {old[1]} → {new[4]} {new[1]}"
+
+
+# ✅ 古いルールで判定した行だけを判定し直す（差分）
+# スナップショットがあれば10件すべて、無ければキャッシュの行に残る候補から判定する。
+# 結果が変わった行ごとに on_change(キー, 旧結果, 新結果) を呼ぶ。dry_run=True なら書き込まない。
+# (判定し直した件数, 結果が変わった件数, スナップショットを使った件数) を返す。
+def reextract(store, snapshots, decide, cpu_pool=None, batch_size=1000, progress=None, dry_run=False, on_change=None):
+    total = changed = from_snapshots = 0
+    rows = store.iter_stale(batch_size)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return total, changed, from_snapshots
+        candidates = []
+        for key, old, _ in batch:
+            snapshot = snapshots.get(key) if snapshots is not None else None
+            if snapshot is not None:
+                from_snapshots += 1
+                candidates.append(snapshot[2])
+            else:
+                candidates.append(stored_candidates(old))
+        results = cpu_map(cpu_pool, decide, [old[0] for _, old, _ in batch], candidates)
+        items = []
+        for (key, old, fetched_at), result in zip(batch, results):
+            if old[1:5] != result[1:5]:
+                changed += 1
+                if on_change is not None:
+                    on_change(key, old, result)
+            items.append((key, result, fetched_at))
+        if not dry_run:
+            store.put_many(items)
+        total += len(batch)
+        if progress is not None:
+            progress.update(len(batch))
+
+
+def add_snapshot_arguments(parser):
+    parser.add_argument("--no-snapshots", action="store_true", help="検索結果の生データを保存しない")
+    parser.add_argument("--reprocess", action="store_true",
+                        help="保存済みの検索結果だけで判定し直し、キャッシュを更新する（ブラウザ不要）")
+    parser.add_argument("--reextract", action="store_true",
+                        help="判定ルールが変わった行だけを判定し直す（ブラウザ不要）")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="--reextract で結果が変わる行を表示するだけで、キャッシュは書き換えない")
+
+
+# ✅ 件数・容量の確認と不要データの削除
+def main():
+    parser = argparse.ArgumentParser(description="検索結果スナップショットの確認")
+    parser.add_argument("db", help="スナップショットのSQLiteファイル")
+    parser.add_argument("--prune", action="store_true", help="参照されていない生データを削除する")
+    parser.add_argument("--show", metavar="KEY", help="1社分の内容を表示する")
+    args = parser.parse_args()
+
+    store = SnapshotStore(args.db)
+    try:
+        if args.prune:
+            print(f"削除: {store.prune()}件")
+        if args.show:
+            print(json.dumps(store.get(args.show), ensure_ascii=False, indent=2))
+        print(store.stats())
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
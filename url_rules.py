@@ -0,0 +1,75 @@
+import re
+import functools
+from urllib.parse import urlsplit
+
+try:
+    import ahocorasick
+except ImportError:  # pyahocorasick が無ければ正規表現の1回走査で代用
+    ahocorasick = None
+
+
+# ✅ URLを1回だけ分解（ホスト名は小文字、パスはそのまま）
+@functools.lru_cache(maxsize=65536)
+def split_url(url):
+    try:
+        parts = urlsplit(url if "//" in url else "//" + url)
+        return (parts.hostname or "").rstrip("."), parts.path or "/"
+    except ValueError:
+        return "", "/"
+
+
+# ✅ ドメイン一覧をホスト名の後方一致（ラベル単位）で引く索引
+# ".co.jp" は co.jp 配下、"note.com" は note.com とそのサブドメインに一致する。
+# "bing.com/ck/a" のようにパスを含む項目はパスの前方一致も条件にする。
+class DomainIndex:
+    def __init__(self, entries):
+        self.entries = list(entries)
+        self._suffixes = {}
+        for i, entry in enumerate(self.entries):
+            host, _, path = entry.strip().lower().lstrip(".").partition("/")
+            rules = self._suffixes.setdefault(host, [])
+            rules.append((i, "/" + path if path else None))
+
+    # 一致した項目のうち最も優先度の高い（一覧で先にある）添字を返す
+    def match(self, url):
+        host, path = split_url(url or "")
+        if not host:
+            return None
+        best = None
+        labels = host.split(".")
+        for start in range(len(labels) - 1, -1, -1):
+            rules = self._suffixes.get(".".join(labels[start:]))
+            if not rules:
+                continue
+            for i, prefix in rules:
+                if prefix is None or path.startswith(prefix):
+                    if best is None or i < best:
+                        best = i
+        return best
+
+    def __contains__(self, url):
+        return self.match(url) is not None
+
+
+# ✅ 複数キーワードの同時検索（Aho-Corasick）
+class KeywordMatcher:
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for kw in self.keywords:
+                self._automaton.add_word(kw, kw)
+            self._automaton.make_automaton()
+            self._regex = None
+        else:
+            self._automaton = None
+            self._regex = re.compile("|".join(re.escape(kw) for kw in self.keywords))
+
+    def search(self, text):
+        if not text or not self.keywords:
+            return False
+        if self._automaton is not None:
+            for _ in self._automaton.iter(text):
+                return True
+            return False
+        return self._regex.search(text) is not None
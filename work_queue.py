@@ -0,0 +1,134 @@
+import os
+import time
+import socket
+import asyncio
+import logging
+import threading
+from run_manifest import RunManifest, open_run
+from sharding import format_shard
+
+# ✅ 実行マニフェストを作業キューとして使う（外部のブローカー不要）
+# --queue で始めた実行には、別のプロセスが --attach RUN で途中から加われる（途中で抜けてもよい）。
+# 各プロセスは行を数十件ずつ借り（リース）、処理中はハートビートで期限を延ばし、結果をマニフェストに書く。
+# プロセスが落ちるとハートビートが止まり、期限が切れた行は他のプロセスが引き取る。
+#   python check_company_name.py input.csv output.csv --queue      （最終出力を書くのはこのプロセス）
+#   python check_company_name.py --attach 20250101-120000          （何個でも・いつでも）
+
+DEFAULT_LEASE_SECONDS = 120.0
+DEFAULT_LEASE_BATCH = 20
+DEFAULT_MAX_ATTEMPTS = 3
+POLL_INTERVAL = 2.0
+
+
+def add_queue_arguments(parser):
+    parser.add_argument("--queue", action="store_true",
+                        help="入力を作業キューに登録してから処理する（他のプロセスが --attach で加われる）")
+    parser.add_argument("--attach", metavar="RUN", help="--queue で実行中の処理に、ワーカーとして加わる")
+    parser.add_argument("--lease-seconds", type=float,
+                        help=f"借りた行の期限（秒、既定 {DEFAULT_LEASE_SECONDS:.0f}）。この間ハートビートが無ければ"
+                             "他のワーカーに回す。--attach では省略するとキュー作成時の値")
+    parser.add_argument("--lease-batch", type=int, default=DEFAULT_LEASE_BATCH, help="1回に借りる行数")
+    parser.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS,
+                        help="同じ行を貸し出す上限（処理中にワーカーが落ち続ける行は失敗にする）")
+
+
+def worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+# ✅ 1つのワーカープロセスの借り手
+# wait=True（--queue の本体）は、他のワーカーの処理中の行が終わるか期限切れで引き取るまで待つ。
+# wait=False（--attach）は、借りられる行が無くなったら抜ける。
+class Lessee:
+    def __init__(self, manifest, worker, batch_size=DEFAULT_LEASE_BATCH, lease_seconds=DEFAULT_LEASE_SECONDS,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS, wait=True, poll=POLL_INTERVAL):
+        self.manifest = manifest
+        self.worker = worker
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.wait = wait
+        self.poll = poll
+        self.leased = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    # 期限の1/3ごとに延ばす
+    def _heartbeat(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                self.manifest.heartbeat(self.worker, self.lease_seconds)
+            except Exception as e:
+                logging.warning(f"ハートビート失敗: {e}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._heartbeat, name="lease-heartbeat", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        released = self.manifest.release(self.worker)
+        if released:
+            logging.info(f"未処理の {released}行をキューに戻しました")
+
+    # (借りた行, 終わりかどうか)
+    def _take(self):
+        rows = self.manifest.lease(self.worker, self.batch_size, self.lease_seconds, self.max_attempts)
+        if rows:
+            self.leased += len(rows)
+            return rows, False
+        if not self.manifest.input_complete:
+            return [], False
+        if self.wait:
+            return [], not self.manifest.unfinished()
+        return [], True
+
+    # process_all にそのまま渡せる行の列（待つ間もパイプラインの後段は動き続ける）
+    def rows(self):
+        while True:
+            rows, done = self._take()
+            if rows:
+                yield from rows
+            elif done:
+                return
+            else:
+                time.sleep(self.poll)
+
+    async def arows(self):
+        while True:
+            rows, done = self._take()
+            if rows:
+                for row in rows:
+                    yield row
+            elif done:
+                return
+            else:
+                await asyncio.sleep(self.poll)
+
+
+# ✅ --queue なら入力をすべて登録して借り手を作り、--attach なら既存のキューを開く
+def open_queue(args, chunksize=1000):
+    shard = getattr(args, "shard", None)
+    if args.attach:
+        manifest = RunManifest.open(args.run_dir, args.attach)
+        if not manifest.is_queue:
+            manifest.close()
+            raise ValueError(f"--queue で始めた実行ではありません: {args.attach}")
+        if manifest.shard != shard:
+            recorded = format_shard(manifest.shard) if manifest.shard else "なし"
+            manifest.close()
+            raise ValueError(f"--shard が作成時と違います（作成時: {recorded}）")
+        lease_seconds = args.lease_seconds or manifest.lease_seconds or DEFAULT_LEASE_SECONDS
+        wait = False
+    else:
+        manifest, _ = open_run(args, chunksize)
+        if args.resume:
+            manifest.requeue_failed()
+        lease_seconds = args.lease_seconds or manifest.lease_seconds or DEFAULT_LEASE_SECONDS
+        manifest.enqueue(lease_seconds, chunksize)
+        wait = True
+    lessee = Lessee(manifest, worker_id(), args.lease_batch, lease_seconds, args.max_attempts, wait)
+    return manifest, lessee